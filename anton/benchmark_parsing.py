@@ -0,0 +1,50 @@
+import glob
+import io
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+from anton.honestdoor_utils import read_property_page
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', '*.html')
+REPEAT = 200
+
+
+def legacy_read_property_page(page_str, property_id):
+    # the previous extraction: two soups, regexes compiled per call and a read_html round trip of the table
+    soup = BeautifulSoup(page_str, 'lxml')
+    table = soup.find('div', attrs={'class': re.compile('^TransactionsSection__Root.*')})
+    df = pd.read_html(io.StringIO(str(table)))[0]
+    df['property_id'] = property_id
+    soup = BeautifulSoup(page_str, 'lxml')
+    value_section = soup.find('div', attrs={'class': re.compile('^AssessmentsSection__Root.*')}).find('span', attrs={
+        'class': re.compile('.*statistic-.*-value.*')})
+    return df, value_section.text
+
+
+def cpu_ms_per_page(extract, pages, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        for name, page_str in pages:
+            extract(page_str, name)
+    return (time.process_time() - start) / (repeat * len(pages)) * 1e3
+
+
+def main(repeat=REPEAT):
+    pages = []
+    for path in sorted(glob.glob(FIXTURES)):
+        with open(path) as f:
+            pages.append((os.path.basename(path), f.read()))
+    legacy = cpu_ms_per_page(legacy_read_property_page, pages, repeat)
+    single = cpu_ms_per_page(read_property_page, pages, repeat)
+    print(f'{len(pages)} fixture page(s), {repeat} rounds')
+    print(f'legacy (bs4 x2 + read_html): {legacy:.2f} ms CPU per page')
+    print(f'single parse (lxml xpath):   {single:.2f} ms CPU per page, {legacy / single:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT)
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import random
+
+import aiohttp
+from loguru import logger as log
+from selenium.common.exceptions import WebDriverException
+
+from anton.honestdoor_utils import AuthError, MissingSectionError
+
+TRANSIENT = 'transient'
+AUTH = 'auth'
+PERMANENT = 'permanent'
+
+# transient failures a property gets before it is dead lettered
+MAX_ATTEMPTS = int(os.getenv('HONESTDOOR_MAX_ATTEMPTS', 5))
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+
+
+def classify(error):
+    """
+    TRANSIENT: worth trying again later (timeouts, dropped connections, a page that had not rendered yet).
+    AUTH: the session was signed out, log in again and retry. PERMANENT: the page will never parse.
+    """
+    if isinstance(error, AuthError):
+        return AUTH
+    if isinstance(error, (MissingSectionError, WebDriverException, aiohttp.ClientError, asyncio.TimeoutError,
+                          ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if isinstance(error, (ValueError, KeyError, IndexError, TypeError)):
+        return PERMANENT
+    return TRANSIENT
+
+
+def backoff(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+
+class FailureHandler:
+    """
+    on_failure callback for ScraperPool that files each failed property back into the WorkQueue: transient and
+    auth failures are retried after an exponential backoff, permanent ones and anything that keeps failing go
+    to the dead letter set with the reason.
+    """
+
+    def __init__(self, work_queue, max_attempts=MAX_ATTEMPTS):
+        self.work_queue = work_queue
+        self.max_attempts = max_attempts
+
+    def __call__(self, property, error):
+        kind = classify(error)
+        reason = f'{type(error).__name__}: {error}'
+        if kind == PERMANENT:
+            log.error(f'Dead lettering {property}, {reason}')
+            self.work_queue.dead_letter(property, kind, reason, attempts=1)
+            return kind
+        attempt = self.work_queue.attempt_failed(property)
+        if attempt >= self.max_attempts:
+            log.error(f'Dead lettering {property} after {attempt} {kind} failures, last {reason}')
+            self.work_queue.dead_letter(property, kind, reason, attempts=attempt)
+            return kind
+        delay = backoff(attempt)
+        log.warning(f'{kind} failure {attempt} for {property} ({reason}), retrying in {delay:.0f}s')
+        self.work_queue.retry(property, delay)
+        return kind
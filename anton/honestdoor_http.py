@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+
+import aiohttp
+from loguru import logger as log
+
+from anton.honestdoor_utils import property_url, AuthError, NOT_FOUND_TEXT, SECTIONS
+from anton.scraper_pool import ScraperPool, WORKERS
+
+# property pages requested at once over the shared session
+CONCURRENCY = int(os.getenv('HONESTDOOR_HTTP_CONCURRENCY', 16))
+TIMEOUT = 20
+
+
+def session_cookies(driver):
+    # the logged in browser's cookies and user agent, so plain http requests look like the same session
+    cookies = {c['name']: c['value'] for c in driver.get_cookies()}
+    return cookies, driver.execute_script('return navigator.userAgent')
+
+
+def complete_page(page_str):
+    return NOT_FOUND_TEXT in page_str or all(section in page_str for section in SECTIONS)
+
+
+async def fetch_page(session, semaphore, property):
+    async with semaphore:
+        async with session.get(property_url(property)) as r:
+            # honestdoor answers a missing property with a 404 page that still carries NOT_FOUND_TEXT
+            if r.status not in (200, 404):
+                r.raise_for_status()
+            return property, await r.text()
+
+
+async def fetch_properties(properties, handle, cookies, user_agent, concurrency=CONCURRENCY):
+    """
+    GET every property page over one pooled aiohttp session and handle(property, page_str) those that came back
+    complete. Returns the properties that have to go through the browser instead, and whether any page was
+    served signed out, meaning the cookies no longer work.
+    """
+    fallback = []
+    signed_out = False
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency)
+    async with aiohttp.ClientSession(cookies=cookies, headers={'User-Agent': user_agent}, connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as session:
+        tasks = [asyncio.ensure_future(fetch_page(session, semaphore, property)) for property in properties]
+        for property, task in zip(properties, tasks):
+            try:
+                _, page_str = await task
+                if not complete_page(page_str):
+                    log.info(f'{property_url(property)} is not server rendered, leaving it to the browser')
+                    fallback.append(property)
+                    continue
+                handle(property, page_str)
+            except AuthError:
+                log.warning(f'{property_url(property)} was served signed out, leaving it to the browser')
+                signed_out = True
+                fallback.append(property)
+            except Exception as e:
+                log.warning(f'HTTP fetch of {property_url(property)} failed with {e!r}, leaving it to the browser')
+                fallback.append(property)
+    return fallback, signed_out
+
+
+class Scraper:
+    """
+    Fetches properties over plain HTTP with the cookies of a logged in browser session, then scrapes whatever
+    that could not handle with a ScraperPool, which reports what still fails to on_failure. The cookies and the
+    pool's sessions are kept across scrape() calls; only a page served signed out throws them away, so the
+    next call logs in again.
+    """
+
+    def __init__(self, workers=WORKERS, concurrency=CONCURRENCY, on_failure=None):
+        self.concurrency = concurrency
+        self.pool = ScraperPool(workers, on_failure=on_failure)
+        self.cookies = None
+        self.user_agent = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _log_in(self):
+        # the first browser session doubles as the source of the cookies and stays in the pool
+        driver = self.pool.acquire()
+        try:
+            self.cookies, self.user_agent = session_cookies(driver)
+        finally:
+            self.pool.release(driver)
+
+    def scrape(self, properties, handle):
+        properties = list(properties)
+        start = time.monotonic()
+        if self.cookies is None:
+            self._log_in()
+        fallback, signed_out = asyncio.run(fetch_properties(properties, handle, self.cookies, self.user_agent,
+                                                            self.concurrency))
+        log.info(f'Fetched {len(properties) - len(fallback)} of {len(properties)} properties over HTTP '
+                 f'in {time.monotonic() - start:.0f}s, {len(fallback)} left for the browser')
+        if signed_out:
+            log.warning('Session cookies were signed out, logging in again')
+            self.cookies = None
+            self.pool.close()
+        if fallback:
+            self.pool.run(fallback, handle)
+
+    def close(self):
+        self.pool.close()
+
+
+def scrape(properties, handle, workers=WORKERS, concurrency=CONCURRENCY, on_failure=None):
+    """One-off scrape of properties, see Scraper."""
+    with Scraper(workers, concurrency, on_failure) as scraper:
+        scraper.scrape(properties, handle)
@@ -1,34 +1,49 @@
 import os
 import re
-from time import sleep
 
-from bs4 import BeautifulSoup
+import lxml.html
 import pandas as pd
 import numpy as np
 import requests
 from dotenv import load_dotenv, find_dotenv
 from loguru import logger as log
+from lxml import etree
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 import ssl
 
+from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 
 ssl._create_default_https_context = ssl._create_unverified_context
 load_dotenv(find_dotenv())
 
+PROPERTY_URL = 'https://www.honestdoor.com/property/'
+NOT_FOUND_TEXT = 'page could not be found'
+# seconds to wait for a page to render before giving up on it
+PAGE_TIMEOUT = int(os.getenv('HONESTDOOR_PAGE_TIMEOUT', 20))
+# the page sections read_property_page needs
+SECTIONS = ['TransactionsSection__Root', 'AssessmentsSection__Root']
+NOT_FOUND_XPATH = f'//*[contains(text(), "{NOT_FOUND_TEXT}")]'
+
 
 def save_html(html, path):
     with open(path, 'wb') as f:
         f.write(html)
 
-def login():
+def property_url(property):
+    prop_url_part = property.split('-calgary')[0] + '-calgary-ab'
+    return f'{PROPERTY_URL}{prop_url_part}'
+
+
+def login(headless=False):
     options = Options()
-    options.headless = False
+    options.headless = headless
     driver = webdriver.Chrome(chrome_options=options)
     driver.get('http://honestdoor.com')
     base_url = driver.current_url
-    sleep(1.5)
     property_url = f'{base_url}property'
     url_test = f'{property_url}/2627-lionel-crescent-sw-calgary-ab'
     log.info(f'Visiting {url_test}')
@@ -37,42 +52,104 @@ def login():
     field_pwd_xpath = '//*[(@id = "password")]'
     field_username_xpath = '//*[(@id = "username")]'
 
+    wait = WebDriverWait(driver, PAGE_TIMEOUT)
+    wait.until(EC.presence_of_all_elements_located((By.XPATH, buttons_xpath)))
     for i in driver.find_elements_by_xpath(buttons_xpath):
         log.info(i.text)
         if 'Sign in' in i.text:
             i.click()
-            sleep(1)
             # Ready to login
-            pwd = driver.find_element_by_xpath(field_pwd_xpath)
+            pwd = wait.until(EC.element_to_be_clickable((By.XPATH, field_pwd_xpath)))
             uname = driver.find_element_by_xpath(field_username_xpath)
             pwd.send_keys(os.environ['HONESTDOOR_PWD'])
             uname.send_keys(os.environ['HONESTDOOR_USERNAME'])
             pwd.send_keys(Keys.ENTER)
+            wait.until(EC.invisibility_of_element_located((By.XPATH, field_pwd_xpath)))
             break
-    sleep(1)
     return driver
 
-def get_page_source(url,driver):
+
+def property_page_ready(driver):
+    # both sections we read have rendered, or the site says there is no such property
+    if driver.find_elements_by_xpath(NOT_FOUND_XPATH):
+        return True
+    return all(driver.find_elements_by_xpath(f'//div[{class_prefix(section)}]') for section in SECTIONS)
+
+
+def get_page_source(url, driver, timeout=PAGE_TIMEOUT):
     driver.get(url)
-    sleep(1.5)
+    WebDriverWait(driver, timeout, poll_frequency=0.1).until(property_page_ready)
     page_str = driver.page_source
     return page_str
 
 
-def read_transaction_table(page_str,property_id):
-    log.info(f'Transactions for {property_id}...')
-    soup = BeautifulSoup(page_str,'lxml')
+def class_prefix(prefix):
+    # a class token starting with prefix, styled components append a hash to the name
+    return f'contains(concat(" ", normalize-space(@class)), " {prefix}")'
 
-    table = soup.find('div', attrs={'class': re.compile('^TransactionsSection__Root.*')})
-    df = pd.read_html(str(table))[0]
-    df['property_id'] = property_id
-    return df
 
-def read_assessment_price(page_str):
-    soup = BeautifulSoup(page_str, 'lxml')
-    # Get city assessment price:
-    value_section = soup.find('div', attrs={'class': re.compile('^AssessmentsSection__Root.*')}).find('span', attrs={
-        'class': re.compile('.*statistic-.*-value.*')})
-    city_price = value_section.text
-    return city_price
+# compiled once, every page is parsed a single time and queried with these
+TRANSACTIONS_TABLE = etree.XPath(f'//div[{class_prefix("TransactionsSection__Root")}]//table')
+TABLE_HEADERS = etree.XPath('.//thead//th')
+TABLE_ROWS = etree.XPath('.//tbody/tr')
+ROW_CELLS = etree.XPath('./td')
+ASSESSMENT_VALUE = etree.XPath(f'//div[{class_prefix("AssessmentsSection__Root")}]'
+                               f'//span[contains(@class, "statistic-") and contains(@class, "-value")]')
+MONEY = re.compile(r'^\$\s*(-?[\d,]+)(\.\d+)?$')
+NUMBER = re.compile(r'^-?[\d,]+$')
+
+
+SIGN_IN_BUTTONS = etree.XPath('//*[contains(concat(" ", @class, " "), " ant-btn-primary ")]//span[contains(., "Sign in")]')
+
 
+class MissingSectionError(ValueError):
+    pass
+
+
+class AuthError(Exception):
+    # the page was served to a signed out session, logging in again fixes it
+    pass
+
+
+def signed_out(tree):
+    return bool(SIGN_IN_BUTTONS(tree))
+
+
+def cell_value(element):
+    text = ''.join(element.itertext()).strip()
+    if not text:
+        return None
+    money = MONEY.match(text)
+    if money:
+        return float(money.group(1).replace(',', '') + money.group(2)) if money.group(2) \
+            else int(money.group(1).replace(',', ''))
+    if NUMBER.match(text):
+        return int(text.replace(',', ''))
+    return text
+
+
+def read_property_page(page_str, property_id):
+    """
+    Parse a property page once and return its transactions, one typed row per sale with the property_id
+    attached, and the city assessment price. Dollar amounts come back as numbers.
+    """
+    tree = lxml.html.fromstring(page_str)
+    tables = TRANSACTIONS_TABLE(tree)
+    if not tables and signed_out(tree):
+        raise AuthError(f'Signed out while reading {property_id}')
+    if not tables:
+        raise MissingSectionError(f'No transactions table for {property_id}')
+    columns = [cell_value(th) for th in TABLE_HEADERS(tables[0])]
+    rows = []
+    for tr in TABLE_ROWS(tables[0]):
+        row = [cell_value(td) for td in ROW_CELLS(tr)]
+        # ant design pads the body with an empty measuring row
+        if any(v is not None for v in row):
+            rows.append(row)
+    df = pd.DataFrame(rows, columns=columns)
+    df['property_id'] = property_id
+    # Get city assessment price:
+    values = ASSESSMENT_VALUE(tree)
+    if not values:
+        raise MissingSectionError(f'No assessment price for {property_id}')
+    return df, cell_value(values[0])
@@ -0,0 +1,177 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+from loguru import logger as log
+from selenium.common.exceptions import WebDriverException
+
+from anton.honestdoor_utils import login, get_page_source, property_url, read_property_page, NOT_FOUND_TEXT, \
+    AuthError
+from src.codec import encode_transactions
+
+namespace = 'house-search'
+# logged in headless Chrome sessions scraping in parallel
+WORKERS = int(os.getenv('SCRAPER_WORKERS', 4))
+# times a property is handed to a fresh session after the one scraping it died
+MAX_RECYCLES = 2
+
+
+def save_property(redis, property, page_str, store):
+    if NOT_FOUND_TEXT in page_str:
+        log.error(f'Page does not exist at {property_url(property)}!')
+        redis.sadd(f'{namespace}:listings_honestdoor_blacklist', property)
+        return False
+    log.info(f'Transactions for {property}...')
+    df, city_price = read_property_page(page_str, property)
+    df['assessment_price'] = city_price
+    store.append(property, df)
+    # populate set at Redis
+    redis.sadd(f'{namespace}:listings_honestdoor', property)
+    redis.set(f'{namespace}:listings_honestdoor/{property}', encode_transactions(df))
+    return True
+
+
+def session_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except WebDriverException:
+        return False
+
+
+class ScraperPool:
+    """
+    `workers` threads, each with its own logged in headless driver, draining one shared queue of properties.
+    handle(property, page_str) is called from the worker threads as pages come in. A driver that dies
+    mid-page is quit, the worker logs in again and the property goes back on the queue; a signed out session
+    gets a fresh login too. Every other failure is passed to on_failure(property, error) when given.
+    Sessions outlive run(), the next run picks up the logged in drivers the last one left, until close().
+    """
+
+    def __init__(self, workers=WORKERS, headless=True, login=login, max_recycles=MAX_RECYCLES, on_failure=None):
+        self.workers = workers
+        self.headless = headless
+        self.login = login
+        self.max_recycles = max_recycles
+        self.on_failure = on_failure
+        self.recycled = Counter()
+        self.done = Counter()
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def acquire(self):
+        # a logged in session, an idle one that is still alive when there is one
+        while True:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                return self.login(headless=self.headless)
+            if session_alive(driver):
+                return driver
+            self._quit(driver)
+
+    def release(self, driver):
+        with self._lock:
+            self._idle.append(driver)
+
+    def close(self):
+        with self._lock:
+            drivers, self._idle = self._idle, []
+        for driver in drivers:
+            self._quit(driver)
+
+    def _count(self, outcome):
+        with self._lock:
+            self.done[outcome] += 1
+
+    def _fail(self, property, error):
+        log.info(f'Failed at {property_url(property)}!')
+        self._count('failed')
+        if self.on_failure is not None:
+            try:
+                self.on_failure(property, error)
+            except Exception as e:
+                log.exception(e)
+
+    @staticmethod
+    def _quit(driver):
+        if driver is not None:
+            try:
+                driver.quit()
+            except WebDriverException:
+                pass
+
+    def _worker(self, work, handle):
+        driver = None
+        while True:
+            property = work.get()
+            if property is None:
+                work.task_done()
+                break
+            url = property_url(property)
+            try:
+                if driver is None:
+                    driver = self.acquire()
+                log.info(f'Processing {url}')
+                handle(property, get_page_source(url, driver))
+                self._count('ok')
+            except WebDriverException as e:
+                if driver is not None and session_alive(driver):
+                    log.exception(e)
+                    self._fail(property, e)
+                else:
+                    log.warning(f'Browser session died at {url}, starting a new one')
+                    self._quit(driver)
+                    driver = None
+                    self._retry(work, property, e)
+            except AuthError as e:
+                log.warning(f'Signed out at {url}, logging in again')
+                self._quit(driver)
+                driver = None
+                self._fail(property, e)
+            except Exception as e:
+                log.exception(e)
+                self._fail(property, e)
+            finally:
+                work.task_done()
+        if driver is not None:
+            self.release(driver)
+
+    def _retry(self, work, property, error):
+        with self._lock:
+            self.recycled[property] += 1
+            recycles = self.recycled[property]
+        if recycles <= self.max_recycles:
+            work.put(property)
+        else:
+            log.error(f'Giving up on {property} after {self.max_recycles} dead sessions')
+            self._fail(property, error)
+
+    def run(self, properties, handle):
+        self.recycled = Counter()
+        self.done = Counter()
+        work = queue.Queue()
+        for property in properties:
+            work.put(property)
+        start = time.monotonic()
+        threads = [threading.Thread(target=self._worker, args=(work, handle), name=f'scraper-{n}', daemon=True)
+                   for n in range(self.workers)]
+        for t in threads:
+            t.start()
+        work.join()
+        for _ in threads:
+            work.put(None)
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - start
+        log.info(f"Scraped {self.done['ok']} properties ({self.done['failed']} failed) with {self.workers} "
+                 f"workers in {elapsed:.0f}s, {self.done['ok'] / max(elapsed, 1e-9):.2f}/s")
+        return self.done
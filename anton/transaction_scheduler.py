@@ -1,63 +1,44 @@
-import json
-import random
+import os
+import socket
 
 from loguru import logger as log
 from redis_dict import RedisDict
-import pandas as pd
-from anton.honestdoor_utils import login, get_page_source, read_transaction_table, read_assessment_price
-import os
+from anton.failures import FailureHandler
+from anton.honestdoor_http import Scraper
+from anton.scraper_pool import save_property, WORKERS
+from anton.transaction_store import TransactionStore
+from anton.work_queue import WorkQueue
 
-# Get a subset from Redis
+# Queue up what needs scraping, then drain the queue alongside any other running schedulers
 namespace = 'house-search'
-NSUB = 1000
+# properties claimed per round, small enough to finish well inside the lease
+BATCH_SIZE = int(os.getenv('HONESTDOOR_BATCH_SIZE', 25 * WORKERS))
 r_dic = RedisDict(namespace=namespace, host="10.30.40.132")
-listings_all = r_dic.redis.smembers('house-search:listings')
-listings_honestdoor = r_dic.redis.smembers('house-search:listings_honestdoor')
-listings_honestdoor_blacklist = r_dic.redis.smembers('house-search:listings_honestdoor_blacklist')
-
-log.info(
-    f'Listings processed: {len(listings_honestdoor)} | total: {len(listings_all)} | blacklisted: {len(listings_honestdoor_blacklist)}')
-listings_difference = list(listings_all - listings_honestdoor - listings_honestdoor_blacklist)
-
-log.info(f'Difference size: {len(listings_difference)}')
-listings_to_process = random.choices(listings_difference, k=NSUB)
-dict_to_process = {'listing': listings_to_process}
-with open('listings.json', 'w') as f:
-    json.dump(dict_to_process, f, indent=4)
+work_queue = WorkQueue(r_dic.redis)
+failures = FailureHandler(work_queue)
+work_queue.enqueue_new()
+work_queue.enqueue_stale()
+log.info(f'Queue: {work_queue.sizes()}')
 
 # Run transaction pulling
-driver = login()
-pages_to_parse = pd.read_json('listings.json')
-tmp_data_folder = os.environ['TMP_DATA']
-os.makedirs(tmp_data_folder, exist_ok=True)
-
-for property in pages_to_parse['listing']:
-
-    prop_url_part = property.split('-calgary')[0] + '-calgary-ab'
-    full_url = f'https://www.honestdoor.com/property/{prop_url_part}'
-
-    if r_dic.redis.sismember('house-search:listings_honestdoor', property):
-        log.error(f'Skipping {full_url}, already processed!')
-        continue
-    fname = os.path.join(tmp_data_folder, f'{property}.json')
-    log.info(f'Processing {full_url}')
-    try:
-        page_str = get_page_source(full_url, driver)
-        if not ('page could not be found' in page_str):
-            df = read_transaction_table(page_str, property)
-            city_price = read_assessment_price(page_str)
-            df['assessment_price'] = city_price
-            df.to_json(fname)
-            # populate set at Redis
-            r_dic.redis.sadd(f'{namespace}:listings_honestdoor', property)
-            r_dic.redis.set(f'{namespace}:listings_honestdoor/{property}', df.to_json())
-        else:
-            log.error(f'Page does not exist at {full_url}!')
-            r_dic.redis.sadd(f'{namespace}:listings_honestdoor_blacklist', property)
-
-
-    except Exception as e:
-        log.exception(e)
-        log.info(f'Failed at {full_url}!')
-driver.close()
-# get a subset of those (10)
+store = TransactionStore(os.environ['TMP_DATA'])
+consumer = f'{socket.gethostname()}-{os.getpid()}'
+# logged in once for the whole run, batches share the cookies and browser sessions
+scraper = Scraper(on_failure=failures)
+
+
+def handle(property, page_str):
+    scraped = save_property(r_dic.redis, property, page_str, store)
+    work_queue.complete(property, scraped=scraped)
+
+
+while True:
+    batch = work_queue.claim(BATCH_SIZE)
+    if not batch:
+        break
+    log.info(f'{consumer} claimed {len(batch)} properties')
+    scraper.scrape(batch, handle)
+    store.flush()
+scraper.close()
+store.close()
+log.info(f'Queue drained: {work_queue.sizes()}')
@@ -0,0 +1,249 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+from loguru import logger as log
+from redis import Redis
+
+from src.codec import encode_transactions
+
+namespace = 'house-search'
+# buffered properties are written out once there are this many, or this many seconds after the last write
+FLUSH_EVERY = int(os.getenv('TRANSACTION_STORE_FLUSH_EVERY', 50))
+FLUSH_INTERVAL = int(os.getenv('TRANSACTION_STORE_FLUSH_INTERVAL', 30))
+# a segment is sealed and a new one started past this size
+SEGMENT_BYTES = 64 * 1024 * 1024
+OPEN_SUFFIX = '.jsonl.open'
+SEALED_SUFFIX = '.jsonl'
+INDEX_SUFFIX = '.idx'
+REPLAY_CHUNK = 500
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError(f'can not store {type(value)}')
+
+
+def to_record(property, df):
+    return {'property': property, 'scraped_at': time.time(), 'columns': [str(c) for c in df.columns],
+            'rows': df.astype(object).where(df.notna(), None).values.tolist()}
+
+
+def to_frame(record):
+    return pd.DataFrame(record['rows'], columns=record['columns'])
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TransactionStore:
+    """
+    Append-only local log of scraped HonestDoor transactions, one JSON line per property in rolling segment
+    files instead of a file per property. Appends are buffered and written every `flush_every` properties or
+    `flush_interval` seconds; each segment has a side index of property -> (offset, length) so get() reads a
+    single line. Segments are written as <name>.jsonl.open and renamed to <name>.jsonl once sealed; compact()
+    and replay() only read sealed segments, so they are safe to run while a scraper is appending. Open segments
+    left behind by a writer that died without close() are recovered and sealed when a store is created.
+    """
+
+    def __init__(self, directory, flush_every=FLUSH_EVERY, flush_interval=FLUSH_INTERVAL,
+                 segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._segment = None
+        self._last_flush = time.monotonic()
+        self.recover()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _new_segment(self):
+        name = f'segment-{time.time_ns()}-{os.getpid()}'
+        return os.path.join(self.directory, name)
+
+    def append(self, property, df):
+        record = to_record(property, df)
+        line = json.dumps(record, default=_default)
+        with self._lock:
+            self._buffer.append((property, record['scraped_at'], line))
+            if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        if self._segment is None:
+            self._segment = self._new_segment()
+        data_path, index_path = self._segment + OPEN_SUFFIX, self._segment + INDEX_SUFFIX
+        with open(data_path, 'ab') as data, open(index_path, 'a') as index:
+            offset = data.tell()
+            for property, scraped_at, line in self._buffer:
+                encoded = (line + '\n').encode()
+                data.write(encoded)
+                index.write(f'{property}\t{offset}\t{len(encoded)}\t{scraped_at}\n')
+                offset += len(encoded)
+            data.flush()
+            os.fsync(data.fileno())
+        log.info(f'Flushed {len(self._buffer)} properties to {data_path}')
+        self._buffer = []
+        if offset >= self.segment_bytes:
+            self._seal()
+
+    def _seal(self):
+        os.replace(self._segment + OPEN_SUFFIX, self._segment + SEALED_SUFFIX)
+        self._segment = None
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._segment is not None:
+                self._seal()
+
+    def _recover_segment(self, segment):
+        # keep the index entries whose line made it to disk whole, cut the data back to the last of them
+        data_path, index_path = segment + OPEN_SUFFIX, segment + INDEX_SUFFIX
+        size = os.path.getsize(data_path)
+        entries, end = [], 0
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if not line.endswith('\n') or len(fields) != 4 or int(fields[1]) != end \
+                            or end + int(fields[2]) > size:
+                        break
+                    entries.append(line)
+                    end += int(fields[2])
+        with open(data_path, 'r+b') as data:
+            data.truncate(end)
+            data.flush()
+            os.fsync(data.fileno())
+        with open(index_path, 'w') as index:
+            index.writelines(entries)
+        os.replace(data_path, segment + SEALED_SUFFIX)
+        return len(entries)
+
+    def recover(self):
+        """Seal the open segments of writers that are no longer running, returns the properties recovered."""
+        recovered = 0
+        for segment in self.segments(OPEN_SUFFIX):
+            # a writer in this process may still be appending, a crashed one came back under a new pid
+            pid = int(segment.rsplit('-', 1)[1])
+            if pid == os.getpid() or _running(pid):
+                continue
+            count = self._recover_segment(segment)
+            log.warning(f'Recovered {count} properties from unsealed segment {segment}')
+            recovered += count
+        return recovered
+
+    def segments(self, suffix=SEALED_SUFFIX):
+        return sorted(path[:-len(suffix)] for path in glob.glob(os.path.join(self.directory, '*' + suffix)))
+
+    def index(self):
+        # the most recently scraped record of each property wins, whichever segment it sits in
+        latest, scraped = {}, {}
+        for segment in self.segments():
+            with open(segment + INDEX_SUFFIX) as f:
+                for line in f:
+                    property, offset, length, scraped_at = line.rstrip('\n').split('\t')
+                    if float(scraped_at) >= scraped.get(property, 0):
+                        latest[property] = (segment, int(offset), int(length))
+                        scraped[property] = float(scraped_at)
+        return latest
+
+    def _read(self, segment, offset, length):
+        with open(segment + SEALED_SUFFIX, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def get(self, property):
+        location = self.index().get(property)
+        return None if location is None else to_frame(self._read(*location))
+
+    def records(self):
+        """The latest record of every property, read segment by segment in file order."""
+        latest = self.index()
+        by_segment = {}
+        for property, (segment, offset, length) in latest.items():
+            by_segment.setdefault(segment, []).append((offset, length))
+        for segment in sorted(by_segment):
+            with open(segment + SEALED_SUFFIX, 'rb') as f:
+                for offset, length in sorted(by_segment[segment]):
+                    f.seek(offset)
+                    yield json.loads(f.read(length))
+
+    def compact(self):
+        """Rewrite the sealed segments into one holding only the latest record per property, then drop them."""
+        old = self.segments()
+        if len(old) < 2:
+            return 0
+        target = self._new_segment()
+        tmp_path = target + '.tmp'
+        count = 0
+        with open(tmp_path, 'wb') as data, open(target + INDEX_SUFFIX, 'w') as index:
+            for record in self.records():
+                encoded = (json.dumps(record, default=_default) + '\n').encode()
+                index.write(f"{record['property']}\t{data.tell()}\t{len(encoded)}\t{record['scraped_at']}\n")
+                data.write(encoded)
+                count += 1
+            data.flush()
+            os.fsync(data.fileno())
+        os.replace(tmp_path, target + SEALED_SUFFIX)
+        for segment in old:
+            os.remove(segment + SEALED_SUFFIX)
+            os.remove(segment + INDEX_SUFFIX)
+        log.info(f'Compacted {len(old)} segments into {target} with {count} properties')
+        return count
+
+    def replay(self, redis: Redis):
+        """Rebuild the listings_honestdoor set and transaction values in redis from the store."""
+        pipe = redis.pipeline(transaction=False)
+        count = 0
+        for record in self.records():
+            property = record['property']
+            pipe.sadd(f'{namespace}:listings_honestdoor', property)
+            pipe.set(f'{namespace}:listings_honestdoor/{property}', encode_transactions(to_frame(record)))
+            count += 1
+            if count % REPLAY_CHUNK == 0:
+                pipe.execute()
+        pipe.execute()
+        log.info(f'Replayed {count} properties into redis')
+        return count
+
+
+def main():
+    store = TransactionStore(os.environ['TMP_DATA'])
+    if 'compact' in sys.argv:
+        store.compact()
+    if 'replay' in sys.argv:
+        store.replay(Redis(host=os.getenv('REDIS_HOST', '10.30.40.132')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import time
+import uuid
+
+from loguru import logger as log
+from redis import Redis
+
+namespace = 'house-search'
+LISTINGS_KEY = f'{namespace}:listings'
+DONE_KEY = f'{namespace}:listings_honestdoor'
+BLACKLIST_KEY = f'{namespace}:listings_honestdoor_blacklist'
+# properties waiting to be scraped, scored by priority band then enqueue time
+QUEUE_KEY = f'{namespace}:honestdoor_queue'
+# properties a scraper is working on, scored by when the lease runs out
+LEASES_KEY = f'{namespace}:honestdoor_leases'
+# when each property was last scraped, what the stale pass reads
+SCRAPED_KEY = f'{namespace}:honestdoor_scraped'
+PENDING_KEY = f'{namespace}:honestdoor_pending'
+# properties backing off after a transient failure, scored by when they may be claimed again
+DELAYED_KEY = f'{namespace}:honestdoor_delayed'
+# failed attempts per property since its last success
+ATTEMPTS_KEY = f'{namespace}:honestdoor_attempts'
+# properties given up on, never queued again, and why
+DEAD_LETTER_KEY = f'{namespace}:honestdoor_dead_letter'
+DEAD_LETTER_REASONS_KEY = f'{namespace}:honestdoor_dead_letter_reasons'
+
+# lower bands are claimed first: listings never scraped, then ones due for a refresh
+NEW = 0
+STALE = 1
+BAND = 10 ** 10
+# seconds a claimed property stays invisible to other scrapers before it is handed out again
+VISIBILITY_TIMEOUT = int(os.getenv('HONESTDOOR_VISIBILITY_TIMEOUT', 1800))
+STALE_AFTER = int(os.getenv('HONESTDOOR_STALE_AFTER', 90 * 24 * 3600))
+
+# KEYS: source set, queue, leases, delayed  ARGV: score
+ENQUEUE_SET = """
+local added = 0
+for _, member in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if not redis.call('ZSCORE', KEYS[3], member) and not redis.call('ZSCORE', KEYS[4], member) then
+        added = added + redis.call('ZADD', KEYS[2], 'NX', ARGV[1], member)
+    end
+end
+return added
+"""
+# KEYS: scraped, queue, leases, delayed, dead letter, blacklist  ARGV: cutoff, score, limit
+ENQUEUE_STALE = """
+local added = 0
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[3])) do
+    if not redis.call('ZSCORE', KEYS[3], member) and not redis.call('ZSCORE', KEYS[4], member)
+            and redis.call('SISMEMBER', KEYS[5], member) == 0 and redis.call('SISMEMBER', KEYS[6], member) == 0 then
+        added = added + redis.call('ZADD', KEYS[2], 'NX', ARGV[2], member)
+    end
+end
+return added
+"""
+# KEYS: queue, leases, delayed  ARGV: now, lease expiry, count, requeue score
+CLAIM = """
+for _, expired in ipairs({KEYS[2], KEYS[3]}) do
+    for _, member in ipairs(redis.call('ZRANGEBYSCORE', expired, '-inf', ARGV[1])) do
+        redis.call('ZREM', expired, member)
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[4], member)
+    end
+end
+local claimed = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+for _, member in ipairs(claimed) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZADD', KEYS[2], ARGV[2], member)
+end
+return claimed
+"""
+
+
+def score(band, now=None):
+    return band * BAND + (now or time.time())
+
+
+class WorkQueue:
+    """
+    Redis backed HonestDoor work queue that any number of scraper processes can drain at once. The set of
+    listings still to scrape is computed server side with SDIFFSTORE and queued by priority; claim() moves
+    properties onto a lease, a property whose lease runs out (its scraper crashed) is queued again on the next
+    claim, and complete() is idempotent so finishing the same property twice is harmless.
+    """
+
+    def __init__(self, redis: Redis, visibility_timeout=VISIBILITY_TIMEOUT):
+        self.redis = redis
+        self.visibility_timeout = visibility_timeout
+        self._enqueue_set = redis.register_script(ENQUEUE_SET)
+        self._enqueue_stale = redis.register_script(ENQUEUE_STALE)
+        self._claim = redis.register_script(CLAIM)
+
+    def enqueue_new(self):
+        # a key of our own, so two schedulers filling at once do not trample each other's difference
+        pending_key = f'{PENDING_KEY}/{uuid.uuid4().hex}'
+        pending = self.redis.sdiffstore(pending_key, [LISTINGS_KEY, DONE_KEY, BLACKLIST_KEY, DEAD_LETTER_KEY])
+        added = self._enqueue_set(keys=[pending_key, QUEUE_KEY, LEASES_KEY, DELAYED_KEY], args=[score(NEW)])
+        self.redis.delete(pending_key)
+        log.info(f'{pending} listings without HonestDoor data, {added} newly queued')
+        return added
+
+    def enqueue_stale(self, max_age=STALE_AFTER, limit=10000):
+        now = time.time()
+        added = self._enqueue_stale(
+            keys=[SCRAPED_KEY, QUEUE_KEY, LEASES_KEY, DELAYED_KEY, DEAD_LETTER_KEY, BLACKLIST_KEY],
+            args=[now - max_age, score(STALE, now), limit])
+        log.info(f'{added} properties older than {max_age}s queued for a refresh')
+        return added
+
+    def claim(self, count=1):
+        now = time.time()
+        claimed = self._claim(keys=[QUEUE_KEY, LEASES_KEY, DELAYED_KEY],
+                              args=[now, now + self.visibility_timeout, count, score(NEW, now)])
+        # RedisDict's client decodes replies, a plain one does not
+        return [m.decode() if isinstance(m, bytes) else m for m in claimed]
+
+    def complete(self, property, scraped=True):
+        pipe = self.redis.pipeline()
+        pipe.zrem(LEASES_KEY, property)
+        pipe.zrem(QUEUE_KEY, property)
+        pipe.zrem(DELAYED_KEY, property)
+        pipe.hdel(ATTEMPTS_KEY, property)
+        if scraped:
+            pipe.zadd(SCRAPED_KEY, {property: time.time()})
+        else:
+            # blacklisted, there is nothing to refresh
+            pipe.zrem(SCRAPED_KEY, property)
+        pipe.execute()
+
+    def attempt_failed(self, property):
+        return self.redis.hincrby(ATTEMPTS_KEY, property, 1)
+
+    def retry(self, property, delay):
+        # off the lease and out of sight until the delay has passed, the next claim after that picks it up
+        pipe = self.redis.pipeline()
+        pipe.zrem(LEASES_KEY, property)
+        pipe.zadd(DELAYED_KEY, {property: time.time() + delay})
+        pipe.execute()
+
+    def dead_letter(self, property, kind, reason, attempts):
+        pipe = self.redis.pipeline()
+        pipe.zrem(LEASES_KEY, property)
+        pipe.zrem(QUEUE_KEY, property)
+        pipe.zrem(DELAYED_KEY, property)
+        pipe.hdel(ATTEMPTS_KEY, property)
+        pipe.zrem(SCRAPED_KEY, property)
+        pipe.sadd(DEAD_LETTER_KEY, property)
+        pipe.hset(DEAD_LETTER_REASONS_KEY, property,
+                  json.dumps({'kind': kind, 'reason': reason, 'attempts': attempts, 'at': time.time()}))
+        pipe.execute()
+
+    def sizes(self):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zcard(QUEUE_KEY)
+        pipe.zcard(LEASES_KEY)
+        pipe.zcard(DELAYED_KEY)
+        pipe.scard(DEAD_LETTER_KEY)
+        return dict(zip(['queued', 'leased', 'delayed', 'dead_letter'], pipe.execute()))
@@ -1,21 +1,35 @@
 import asyncio
+import hashlib
 import os
-import asyncio_redis
 import time
-import requests
+import redis.asyncio as aioredis
 from typing import Optional
 from pydantic import BaseModel
 import re
 import math
-import functools
 from loguru import logger as log
 
+from codec import encode_listing
+from http_client import PooledClient
+from tiling import bounding_box_from_env, retrievable_records, walk_tiles
+
 API_URL = 'https://api37.realtor.ca'
 NAMESPACE = "house-search:"
 LISTING_COLLECTION_KEY = "listings"
-
-REDIS_CONN_COUNT = 100
-PARALLEL_PAGE_PULL_COUNT = 5
+# url_key -> sha1 of the stored listing json, used to find what changed between polls
+LISTING_HASHES_KEY = "listings_hashes"
+# stream of added / changed listings consumed by the downtown and scoring workers
+LISTING_CHANGES_STREAM = "listings_changes"
+CHANGES_STREAM_MAXLEN = 100000
+
+# the batched writer needs a single connection, the rest is headroom
+REDIS_CONN_COUNT = 4
+# concurrent connections to the realtor.ca API, retries with backoff keep this safe to raise
+PARALLEL_PAGE_PULL_COUNT = int(os.getenv("PARALLEL_PAGE_PULL_COUNT", 10))
+# pages waiting for the writer, bounds memory to roughly this many pages plus the ones in flight
+PAGE_QUEUE_SIZE = 2 * PARALLEL_PAGE_PULL_COUNT
+# listings per redis pipeline
+STORE_BATCH_SIZE = int(os.getenv("STORE_BATCH_SIZE", 1000))
 
 class ListingModel(BaseModel):
     address: str
@@ -35,9 +49,9 @@ class ListingModel(BaseModel):
     photo_url: Optional[str]
 
 
-async def store_single_listing_data(data_chunk, redis, redis_semaphore):
+def parse_listing(data_chunk):
     address = data_chunk['Property']['Address']['AddressText']
-    log.info(f"Storing address={address}")
+    log.info(f"Parsing address={address}")
 
     regex_match = re.search('/real-estate/([0-9]*)/(.*)', data_chunk["RelativeDetailsURL"])
     url_key = regex_match.group(2)
@@ -102,25 +116,104 @@ async def store_single_listing_data(data_chunk, redis, redis_semaphore):
                            long=long,
                            )
 
-    async with redis_semaphore:
-        transaction = await redis.multi()
-        await transaction.set(NAMESPACE+LISTING_COLLECTION_KEY+"/"+url_key, listing.json())
-        await transaction.sadd(NAMESPACE+LISTING_COLLECTION_KEY, [url_key])
-
-        await transaction.exec()
-
-
-async def poll_page(page, options, page_pull_semaphore):
-    async with page_pull_semaphore:
-        log.info(f"pulling page {page}")
-        loop = asyncio.get_event_loop()
-        options["CurrentPage"] = page
-        post = functools.partial(requests.post, API_URL + "/Listing.svc/PropertySearch_Post", data=options)
-        result = await loop.run_in_executor(None, post)
-    return result.json()["Results"]
-
-
-async def poll_search_url(redis, redis_semaphore):
+    return listing
+
+
+async def poll_page(page, options, client):
+    log.info(f"pulling page {page}")
+    # copy, the pulls run concurrently and must not share one CurrentPage
+    options = dict(options, CurrentPage=page)
+    result = await client.post_json("/Listing.svc/PropertySearch_Post", options, label=f"page {page}")
+    return result["Results"]
+
+
+async def queue_page(page, options, client, page_queue):
+    # put blocks while the writer is behind, which holds back further pulls
+    await page_queue.put(await poll_page(page, options, client))
+
+
+async def store_listing_batch(batch, redis):
+    """
+    Store a batch of raw search results with two round trips: an HMGET of the stored content hashes, then one
+    transaction with a SET per added/changed listing, a single SADD of every key, the new hashes and the change
+    stream entries. Returns the number of listings added or changed.
+    """
+    listings = {}
+    for chunk in batch:
+        try:
+            listing = parse_listing(chunk)
+        except Exception as e:
+            log.error(f"Failed to parse listing {chunk.get('MlsNumber')}: {e!r}")
+            continue
+        listings[listing.key] = listing
+    if not listings:
+        return 0
+
+    url_keys = list(listings)
+    # hashed on the json form so the digest does not depend on the storage encoding
+    digests = [hashlib.sha1(listings[k].json().encode()).hexdigest() for k in url_keys]
+    stored_digests = await redis.hmget(NAMESPACE+LISTING_HASHES_KEY, url_keys)
+
+    async with redis.pipeline(transaction=True) as transaction:
+        transaction.sadd(NAMESPACE+LISTING_COLLECTION_KEY, *url_keys)
+        changed = {}
+        for url_key, digest, stored_digest in zip(url_keys, digests, stored_digests):
+            if stored_digest is not None and stored_digest.decode() == digest:
+                # unchanged since the last poll, nothing to store or recompute
+                continue
+            change = "added" if stored_digest is None else "changed"
+            changed[url_key] = digest
+            transaction.set(NAMESPACE+LISTING_COLLECTION_KEY+"/"+url_key, encode_listing(listings[url_key].dict()))
+            transaction.xadd(NAMESPACE+LISTING_CHANGES_STREAM, {"key": url_key, "change": change},
+                             maxlen=CHANGES_STREAM_MAXLEN, approximate=True)
+        if changed:
+            transaction.hset(NAMESPACE+LISTING_HASHES_KEY, mapping=changed)
+        await transaction.execute()
+    return len(changed)
+
+
+async def listing_writer(page_queue, redis, batch_size=STORE_BATCH_SIZE):
+    # drains pages from the queue until it gets None, returns (seen, changed) counts
+    seen = changed = batches = 0
+    batch = []
+    # neighbouring tiles share their edges, keep the first copy of each listing
+    mls_numbers = set()
+    start = time.monotonic()
+    while True:
+        page = await page_queue.get()
+        if page is None:
+            break
+        for chunk in page:
+            if chunk.get("MlsNumber") in mls_numbers:
+                continue
+            mls_numbers.add(chunk.get("MlsNumber"))
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                changed += await store_listing_batch(batch, redis)
+                seen += len(batch)
+                batches += 1
+                batch = []
+    if batch:
+        changed += await store_listing_batch(batch, redis)
+        seen += len(batch)
+        batches += 1
+    elapsed = time.monotonic() - start
+    log.info(f"Wrote {seen} listings in {batches} batches over {elapsed:.2f}s "
+             f"({seen / elapsed if elapsed else 0:.0f} listings/s)")
+    return seen, changed
+
+
+async def poll_tile(box, first_page, search_opts, client, page_queue):
+    # first_page is the tile's page 1 from the tiling search, pull the rest of its pages
+    await page_queue.put(first_page["Results"])
+    total, cap = retrievable_records(first_page["Paging"])
+    pages = math.ceil(min(total, cap)/int(first_page["Paging"]["RecordsPerPage"]))
+    log.info(f"Tile {box} has {total} records, about to pull {max(pages-1, 0)} more pages")
+    tile_opts = box.search_opts(search_opts)
+    await asyncio.gather(*[queue_page(pg, tile_opts, client, page_queue) for pg in range(2, pages + 1)])
+
+
+async def poll_search_url(redis, client, bounding_box=None):
 
     search_opts = {
         "CultureId": 1,
@@ -130,32 +223,41 @@ async def poll_search_url(redis, redis_semaphore):
         "CurrentPage": 1,
         "PriceMin": 100000,
         "PriceMax": 2000000,
-        "LongitudeMin": -114.40999,
-        "LongitudeMax": -113.76385,
-        "LatitudeMin": 50.77617,
-        "LatitudeMax": 51.27885,
     }
-    search_result = requests.post(API_URL + "/Listing.svc/PropertySearch_Post", data=search_opts)
-
-    # Identify number of requests to make
-    # "Paging":{"RecordsPerPage":500,"CurrentPage":1,"TotalRecords":6206,"MaxRecords":500,"TotalPages":1,"RecordsShowing":500,"Pins":1961}
-    paging_data = search_result.json()["Paging"]
-    pages = math.ceil(int(paging_data["TotalRecords"])/int(paging_data["RecordsPerPage"]))
-
-    listing_results = search_result.json()["Results"]
-
-    page_pull_semaphore = asyncio.BoundedSemaphore(value=PARALLEL_PAGE_PULL_COUNT)
-    page_tasks = [poll_page(pg, search_opts, page_pull_semaphore) for pg in range(2, pages)]
-    log.info(f"About to pull {pages-1} of data")
-
-    page_results = await asyncio.gather(*page_tasks)
-
-    for result in page_results:
-        listing_results.extend(result)
-
-    # store data for the individual results
-    tasks = [store_single_listing_data(chunk, redis, redis_semaphore) for chunk in listing_results]
-    await asyncio.gather(*tasks)
+    bounding_box = bounding_box or bounding_box_from_env()
+
+    async def search(box):
+        # Identify number of requests to make
+        # "Paging":{"RecordsPerPage":500,"CurrentPage":1,"TotalRecords":6206,"MaxRecords":500,"TotalPages":1,"RecordsShowing":500,"Pins":1961}
+        return await client.post_json("/Listing.svc/PropertySearch_Post", box.search_opts(search_opts),
+                                      label=f"tile {box} page 1")
+
+    async def on_leaf(box, first_page):
+        await poll_tile(box, first_page, search_opts, client, page_queue)
+
+    async def walk():
+        searches = await walk_tiles(search, bounding_box, on_leaf)
+        await page_queue.put(None)
+        return searches
+
+    page_queue = asyncio.Queue(maxsize=PAGE_QUEUE_SIZE)
+    # storage starts on the first tile while the rest are still being searched and pulled
+    writer = asyncio.create_task(listing_writer(page_queue, redis))
+    walker = asyncio.create_task(walk())
+    try:
+        # a dead writer never drains the queue again, so the producers have to be stopped rather than awaited
+        await asyncio.wait([writer, walker], return_when=asyncio.FIRST_EXCEPTION)
+        for task in (writer, walker):
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+    finally:
+        for task in (walker, writer):
+            task.cancel()
+        await asyncio.gather(walker, writer, return_exceptions=True)
+    searches = walker.result()
+    seen, changed = writer.result()
+    log.info(f"{changed} of {seen} listings added or changed after {searches} tile searches")
+    client.log_timings()
 
 
 async def main():
@@ -165,18 +267,19 @@ async def main():
 
     log.info(f"starting with redis_host={redis_host} and delay_time={delay_time}")
 
-    redis_connection = await asyncio_redis.Pool.create(host=redis_host, poolsize=REDIS_CONN_COUNT)
-    redis_semaphore = asyncio.BoundedSemaphore(value=REDIS_CONN_COUNT)
+    redis_connection = aioredis.Redis(host=redis_host, max_connections=REDIS_CONN_COUNT)
 
-    while True:
-        # poll mls search
-        log.info("about to poll")
-        await poll_search_url(redis_connection, redis_semaphore)
+    async with PooledClient(API_URL, limit_per_host=PARALLEL_PAGE_PULL_COUNT) as client:
+        while True:
+            # poll mls search
+            log.info("about to poll")
+            await poll_search_url(redis_connection, client)
 
-        # wait
-        time.sleep(delay_time)
+            # wait
+            await asyncio.sleep(delay_time)
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
 
 
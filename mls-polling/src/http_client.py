@@ -0,0 +1,96 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+from loguru import logger as log
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+TIMEOUT = 60
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RequestTiming:
+    def __init__(self, label, seconds, attempts, status):
+        self.label = label
+        self.seconds = seconds
+        self.attempts = attempts
+        self.status = status
+
+
+class PooledClient:
+    """
+    One keep-alive aiohttp session for every request of a poll. limit_per_host caps concurrent connections
+    to a host, 429 and 5xx responses are retried with exponential backoff and jitter (or the server's
+    Retry-After), and each request's wall time is kept in `timings`.
+    """
+
+    def __init__(self, base_url, limit_per_host, max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE,
+                 timeout=TIMEOUT):
+        self.base_url = base_url
+        self.limit_per_host = limit_per_host
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.session = None
+        self.timings = []
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    def backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return min(BACKOFF_MAX, self.backoff_base * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+    async def _post_once(self, path, data):
+        async with self.session.post(self.base_url + path, data=data) as r:
+            if r.status in RETRY_STATUSES:
+                retry_after = r.headers.get("Retry-After")
+                raise RetryableStatus(r.status, float(retry_after) if retry_after and retry_after.isdigit() else None)
+            r.raise_for_status()
+            # realtor.ca answers with text/plain, so skip aiohttp's content type check
+            return r.status, await r.json(content_type=None)
+
+    async def post_json(self, path, data, label=None):
+        label = label or path
+        start = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                status, body = await self._post_once(path, data)
+                timing = RequestTiming(label, time.monotonic() - start, attempt, status)
+                log.info(f"{label} took {timing.seconds:.2f}s in {attempt} attempt(s)")
+                self.timings.append(timing)
+                return body
+            except (RetryableStatus, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt == self.max_attempts:
+                    self.timings.append(RequestTiming(label, time.monotonic() - start, attempt,
+                                                      getattr(e, "status", None)))
+                    raise
+                delay = self.backoff(attempt, getattr(e, "retry_after", None))
+                log.warning(f"{label} failed with {e!r} on attempt {attempt}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def log_timings(self):
+        if not self.timings:
+            return
+        seconds = sorted(t.seconds for t in self.timings)
+        retried = sum(t.attempts > 1 for t in self.timings)
+        log.info(f"{len(seconds)} requests, p50={seconds[len(seconds) // 2]:.2f}s "
+                 f"p95={seconds[int(len(seconds) * 0.95)]:.2f}s max={seconds[-1]:.2f}s retried={retried}")
+        self.timings = []
@@ -0,0 +1,62 @@
+import asyncio
+import os
+from typing import NamedTuple
+
+from loguru import logger as log
+
+# Calgary, override with SEARCH_BOUNDING_BOX="lat_min,lat_max,long_min,long_max" for another city
+DEFAULT_BOUNDING_BOX = (50.77617, 51.27885, -114.40999, -113.76385)
+# a tile this deep is ~1/65000 of the box, past that splitting will not get under the cap
+MAX_DEPTH = 8
+
+
+class BoundingBox(NamedTuple):
+    lat_min: float
+    lat_max: float
+    long_min: float
+    long_max: float
+
+    def split(self):
+        lat_mid = (self.lat_min + self.lat_max) / 2
+        long_mid = (self.long_min + self.long_max) / 2
+        return [BoundingBox(self.lat_min, lat_mid, self.long_min, long_mid),
+                BoundingBox(self.lat_min, lat_mid, long_mid, self.long_max),
+                BoundingBox(lat_mid, self.lat_max, self.long_min, long_mid),
+                BoundingBox(lat_mid, self.lat_max, long_mid, self.long_max)]
+
+    def search_opts(self, options):
+        return dict(options, LatitudeMin=self.lat_min, LatitudeMax=self.lat_max,
+                    LongitudeMin=self.long_min, LongitudeMax=self.long_max)
+
+
+def bounding_box_from_env():
+    value = os.getenv("SEARCH_BOUNDING_BOX")
+    if value is None:
+        return BoundingBox(*DEFAULT_BOUNDING_BOX)
+    return BoundingBox(*[float(v) for v in value.split(",")])
+
+
+def retrievable_records(paging):
+    # the API reports every match in TotalRecords but only hands out MaxRecords of them
+    total = int(paging["TotalRecords"])
+    cap = int(paging.get("MaxRecords") or total)
+    return total, cap
+
+
+async def walk_tiles(search, box, on_leaf, max_depth=MAX_DEPTH, depth=0):
+    """
+    Adaptive quadtree over box. search(box) returns the first page of results for a box; any box with more
+    records than the API will return is split in four and the quarters searched in parallel. on_leaf(box, response)
+    is awaited with the first page of every tile that fits under the cap. Returns the number of searches made.
+    """
+    response = await search(box)
+    total, cap = retrievable_records(response["Paging"])
+    if total > cap and depth < max_depth:
+        log.info(f"Splitting tile {box} at depth {depth}, {total} records over the cap of {cap}")
+        counts = await asyncio.gather(*[walk_tiles(search, child, on_leaf, max_depth, depth + 1)
+                                        for child in box.split()])
+        return 1 + sum(counts)
+    if total > cap:
+        log.warning(f"Tile {box} still has {total} records at max depth, only {cap} will be pulled")
+    await on_leaf(box, response)
+    return 1
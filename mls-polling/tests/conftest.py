@@ -0,0 +1,7 @@
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src"))
+# the image gets src/codec.py copied next to app.py, point at the shared copy instead
+sys.path.append(os.path.join(HERE, "..", "..", "src"))
@@ -0,0 +1,60 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import app
+from tiling import BoundingBox
+
+BOX = BoundingBox(51.0, 51.1, -114.1, -114.0)
+RECORDS_PER_PAGE = 50
+
+
+def listing_chunk(i):
+    return {"Id": str(i), "MlsNumber": f"A{i}", "RelativeDetailsURL": f"/real-estate/{i}/{i}-some-street",
+            "Property": {"Address": {"AddressText": f"{i} Some Street|Calgary", "Latitude": 51.05,
+                                     "Longitude": -114.05},
+                         "Price": "$500,000"},
+            "Land": {}, "Building": {"BathroomTotal": "2", "Bedrooms": "3"}}
+
+
+class FakeSearch:
+    """Stands in for PooledClient: one tile of `pages` pages, records which CurrentPage each pull asked for."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    async def post_json(self, path, data, label=None):
+        page = data["CurrentPage"]
+        self.requested.append(page)
+        await asyncio.sleep(0)
+        first = (page - 1) * RECORDS_PER_PAGE
+        return {"Paging": {"TotalRecords": self.pages * RECORDS_PER_PAGE, "MaxRecords": 10000,
+                           "RecordsPerPage": RECORDS_PER_PAGE},
+                "Results": [listing_chunk(i) for i in range(first, first + RECORDS_PER_PAGE)]}
+
+    def log_timings(self):
+        pass
+
+
+class BrokenRedis:
+    async def hmget(self, *args):
+        raise ConnectionError("redis went away")
+
+
+def test_dead_writer_stops_the_poll():
+    # far more pages than the queue holds, so the producers are blocked on put when the writer dies
+    client = FakeSearch(pages=app.PAGE_QUEUE_SIZE * 3)
+    with pytest.raises(ConnectionError):
+        asyncio.run(asyncio.wait_for(app.poll_search_url(BrokenRedis(), client, BOX), timeout=10))
+
+
+def test_poll_stores_every_page():
+    redis = fakeredis.FakeAsyncRedis()
+    client = FakeSearch(pages=5)
+    asyncio.run(app.poll_search_url(redis, client, BOX))
+
+    async def stored():
+        return await redis.scard(app.NAMESPACE + app.LISTING_COLLECTION_KEY)
+    assert asyncio.run(stored()) == 5 * RECORDS_PER_PAGE
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import app
+from http_client import PooledClient, RetryableStatus
+
+
+class StubSearch:
+    """Local stand-in for the realtor.ca search endpoint, answers with the queued statuses and then 200."""
+
+    def __init__(self, statuses=(), retry_after=None):
+        self.statuses = list(statuses)
+        self.retry_after = retry_after
+        self.calls = []
+        self.peers = set()
+
+    async def handle(self, request):
+        form = await request.post()
+        self.calls.append((time.monotonic(), dict(form)))
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.statuses:
+            headers = {"Retry-After": self.retry_after} if self.retry_after else None
+            return web.Response(status=self.statuses.pop(0), headers=headers)
+        # text/plain like the real API
+        body = {"Results": [{"CurrentPage": form.get("CurrentPage")}]}
+        return web.Response(text=json.dumps(body), content_type="text/plain")
+
+
+def run_client(stub, use, **kwargs):
+    kwargs.setdefault("limit_per_host", 4)
+
+    async def go():
+        web_app = web.Application()
+        web_app.router.add_post("/Listing.svc/PropertySearch_Post", stub.handle)
+        async with TestServer(web_app) as server:
+            async with PooledClient(str(server.make_url("")), **kwargs) as client:
+                return await use(client), client
+    return asyncio.run(go())
+
+
+def search(client, label="search"):
+    return client.post_json("/Listing.svc/PropertySearch_Post", {"CurrentPage": 1}, label=label)
+
+
+def test_retries_429_and_5xx():
+    stub = StubSearch([503, 429, 502])
+    body, client = run_client(stub, search, backoff_base=0.01)
+    assert body == {"Results": [{"CurrentPage": "1"}]}
+    assert len(stub.calls) == 4
+    assert [(t.label, t.attempts, t.status) for t in client.timings] == [("search", 4, 200)]
+
+
+def test_retry_after_is_honoured():
+    stub = StubSearch([429], retry_after="1")
+    run_client(stub, search, backoff_base=0.01)
+    (first, _), (second, _) = stub.calls
+    assert second - first >= 1
+
+
+def test_gives_up_after_max_attempts():
+    stub = StubSearch([500] * 10)
+    with pytest.raises(RetryableStatus) as error:
+        run_client(stub, search, backoff_base=0.01, max_attempts=3)
+    assert error.value.status == 500
+    assert len(stub.calls) == 3
+
+
+def test_client_errors_are_not_retried():
+    stub = StubSearch([404])
+    with pytest.raises(Exception):
+        run_client(stub, search, backoff_base=0.01)
+    assert len(stub.calls) == 1
+
+
+def test_connection_is_reused():
+    async def five_in_a_row(client):
+        for i in range(5):
+            await search(client, label=f"search {i}")
+
+    stub = StubSearch()
+    _, client = run_client(stub, five_in_a_row, limit_per_host=1)
+    assert len(stub.calls) == 5
+    assert len(stub.peers) == 1
+
+
+def test_timings_are_recorded_and_reset():
+    async def two(client):
+        await search(client, label="first")
+        await search(client, label="second")
+
+    stub = StubSearch([503])
+    _, client = run_client(stub, two, backoff_base=0.01)
+    assert [(t.label, t.attempts) for t in client.timings] == [("first", 2), ("second", 1)]
+    assert all(t.seconds > 0 for t in client.timings)
+    client.log_timings()
+    assert client.timings == []
+
+
+def test_concurrent_pages_keep_their_own_current_page():
+    options = {"RecordsPerPage": 500, "CurrentPage": 1}
+
+    async def pages(client):
+        return await asyncio.gather(*[app.poll_page(page, options, client) for page in range(1, 7)])
+
+    stub = StubSearch()
+    results, _ = run_client(stub, pages)
+    assert [r[0]["CurrentPage"] for r in results] == [str(page) for page in range(1, 7)]
+    assert sorted(int(form["CurrentPage"]) for _, form in stub.calls) == list(range(1, 7))
+    assert options["CurrentPage"] == 1
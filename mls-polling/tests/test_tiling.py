@@ -0,0 +1,151 @@
+import asyncio
+
+import fakeredis
+
+import app
+from tiling import BoundingBox, retrievable_records, walk_tiles
+
+BOX = BoundingBox(51.0, 51.2, -114.2, -114.0)
+CAP = 20
+
+
+def listing_chunk(i, lat, long):
+    return {"Id": str(i), "MlsNumber": f"A{i}", "RelativeDetailsURL": f"/real-estate/{i}/{i}-some-street",
+            "Property": {"Address": {"AddressText": f"{i} Some Street|Calgary", "Latitude": lat, "Longitude": long},
+                         "Price": "$500,000"},
+            "Land": {}, "Building": {"BathroomTotal": "2", "Bedrooms": "3"}}
+
+
+class FakeSearch:
+    """Stands in for the realtor.ca search: listings at fixed points, a box matches its edges inclusively."""
+
+    def __init__(self, points, cap=CAP):
+        self.listings = [listing_chunk(i, lat, long) for i, (lat, long) in enumerate(points)]
+        self.cap = cap
+        self.boxes = []
+
+    def inside(self, box):
+        return [chunk for chunk in self.listings
+                if box.lat_min <= chunk["Property"]["Address"]["Latitude"] <= box.lat_max
+                and box.long_min <= chunk["Property"]["Address"]["Longitude"] <= box.long_max]
+
+    async def search(self, box):
+        self.boxes.append(box)
+        await asyncio.sleep(0)
+        found = self.inside(box)
+        return {"Paging": {"TotalRecords": len(found), "MaxRecords": self.cap, "RecordsPerPage": self.cap},
+                "Results": found[:self.cap]}
+
+    async def post_json(self, path, data, label=None):
+        # the client poll_search_url talks to, every tile fits on its first page here
+        return await self.search(BoundingBox(data["LatitudeMin"], data["LatitudeMax"],
+                                             data["LongitudeMin"], data["LongitudeMax"]))
+
+    def log_timings(self):
+        pass
+
+
+def walk(search, box=BOX, **kwargs):
+    leaves = []
+
+    async def on_leaf(leaf, response):
+        leaves.append((leaf, response))
+
+    searches = asyncio.run(walk_tiles(search.search, box, on_leaf, **kwargs))
+    return searches, leaves
+
+
+def cluster(count, lat, long):
+    return [(lat, long)] * count
+
+
+def test_split_quarters_the_box():
+    quarters = BOX.split()
+    assert len(quarters) == 4
+    assert set(quarters) == {BoundingBox(51.0, 51.1, -114.2, -114.1), BoundingBox(51.0, 51.1, -114.1, -114.0),
+                             BoundingBox(51.1, 51.2, -114.2, -114.1), BoundingBox(51.1, 51.2, -114.1, -114.0)}
+
+
+def test_retrievable_records():
+    assert retrievable_records({"TotalRecords": "620", "MaxRecords": "500"}) == (620, 500)
+    # no cap reported, everything is retrievable
+    assert retrievable_records({"TotalRecords": "620"}) == (620, 620)
+
+
+def test_tile_under_the_cap_is_not_split():
+    search = FakeSearch(cluster(CAP, 51.05, -114.15))
+    searches, leaves = walk(search)
+    assert searches == 1
+    assert [leaf for leaf, _ in leaves] == [BOX]
+
+
+def test_tile_over_the_cap_splits_into_four():
+    # one over the cap in total, but every quarter fits
+    points = (cluster(6, 51.05, -114.15) + cluster(5, 51.05, -114.05) + cluster(5, 51.15, -114.15)
+              + cluster(5, 51.15, -114.05))
+    search = FakeSearch(points)
+    searches, leaves = walk(search)
+    assert searches == 5
+    assert sorted(leaf for leaf, _ in leaves) == sorted(BOX.split())
+    assert sum(len(response["Results"]) for _, response in leaves) == len(points)
+
+
+def test_only_crowded_quarters_split_further():
+    points = cluster(CAP + 1, 51.01, -114.19) + cluster(3, 51.15, -114.05)
+    search = FakeSearch(points)
+    searches, leaves = walk(search)
+    # the crowded corner keeps splitting down to MAX_DEPTH, its siblings and the sparse quarters stop at once
+    assert searches == 1 + 4 * 8
+    crowded = [leaf for leaf, response in leaves if response["Paging"]["TotalRecords"] > CAP]
+    assert len(crowded) == 1
+    assert abs((crowded[0].lat_max - crowded[0].lat_min) - 0.2 / 2 ** 8) < 1e-9
+    assert len(leaves) == 3 * 8 + 1
+
+
+def test_splitting_stops_at_max_depth():
+    search = FakeSearch(cluster(CAP + 1, 51.01, -114.19))
+    searches, leaves = walk(search, max_depth=2)
+    # depth 0 splits, depth 1 splits the crowded quarter, depth 2 gives up and pulls what the cap allows
+    assert searches == 1 + 4 + 4
+    crowded = [(leaf, response) for leaf, response in leaves if response["Paging"]["TotalRecords"] > CAP]
+    assert len(crowded) == 1
+    leaf, response = crowded[0]
+    assert leaf == BOX.split()[0].split()[0]
+    assert len(response["Results"]) == CAP
+
+
+def test_max_depth_zero_never_splits():
+    search = FakeSearch(cluster(CAP * 3, 51.05, -114.15))
+    searches, leaves = walk(search, max_depth=0)
+    assert searches == 1
+    assert [leaf for leaf, _ in leaves] == [BOX]
+
+
+def test_listings_on_shared_edges_are_stored_once():
+    # the centre and the midpoints of the inner edges fall in two or four quarters at once
+    edges = [(51.1, -114.1), (51.1, -114.15), (51.1, -114.05), (51.05, -114.1), (51.15, -114.1)]
+    points = edges + cluster(CAP, 51.02, -114.18) + cluster(3, 51.18, -114.02)
+    search = FakeSearch(points)
+    _, leaves = walk(search)
+    pages = [response["Results"] for _, response in leaves]
+    returned = [chunk["MlsNumber"] for page in pages for chunk in page]
+    assert len(returned) > len(set(returned)) == len(points)
+
+    async def write():
+        page_queue = asyncio.Queue()
+        for page in pages + [None]:
+            page_queue.put_nowait(page)
+        return await app.listing_writer(page_queue, fakeredis.FakeAsyncRedis())
+    seen, changed = asyncio.run(write())
+    assert seen == changed == len(points)
+
+
+def test_poll_stores_listings_on_shared_edges():
+    edges = [(51.1, -114.1), (51.1, -114.15), (51.05, -114.1)]
+    points = edges + cluster(CAP, 51.02, -114.18)
+    redis = fakeredis.FakeAsyncRedis()
+    asyncio.run(app.poll_search_url(redis, FakeSearch(points), BOX))
+
+    async def stored():
+        return await redis.scard(app.NAMESPACE + app.LISTING_COLLECTION_KEY)
+    assert asyncio.run(stored()) == len(points)
@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# the map draws individual listings only when the viewport holds at most this many, grid cells otherwise
+POINT_THRESHOLD = int(os.getenv("MAP_POINT_THRESHOLD", 2000))
+# cells across the viewport's width and height when binning
+GRID_BINS = int(os.getenv("MAP_GRID_BINS", 40))
+
+
+def in_viewport(easting, northing, x_range, y_range):
+    return (easting >= x_range[0]) & (easting <= x_range[1]) & (northing >= y_range[0]) & (northing <= y_range[1])
+
+
+def grid_bins(easting, northing, price, x_range, y_range, bins=GRID_BINS):
+    """
+    Bin the listings into a bins x bins grid over the viewport. Returns ColumnDataSource data for the
+    non-empty cells: centre, size, listing count and median price.
+    """
+    width = (x_range[1] - x_range[0]) / bins
+    height = (y_range[1] - y_range[0]) / bins
+    column = np.clip(((easting - x_range[0]) // width).astype(int), 0, bins - 1)
+    row = np.clip(((northing - y_range[0]) // height).astype(int), 0, bins - 1)
+    cells = pd.DataFrame({'cell': row * bins + column, 'price': price}).groupby('cell')['price'].agg(['size', 'median'])
+    cell = cells.index.to_numpy()
+    return {
+        'x': x_range[0] + (cell % bins + 0.5) * width,
+        'y': y_range[0] + (cell // bins + 0.5) * height,
+        'width': np.full(len(cell), width),
+        'height': np.full(len(cell), height),
+        'count': cells['size'].to_numpy(),
+        'median_price': cells['median'].to_numpy(),
+    }
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+
+from src.location import build_commute, check_transit_route
+from src.routing_cache import is_cacheable
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+TRANSIT_URL = 'https://transit.router.hereapi.com/v8/routes'
+ROUTER_URL = 'https://router.hereapi.com/v8/routes'
+
+# requests in flight and requests started per second, across every listing in a batch
+CONCURRENCY = int(os.getenv("HERE_CONCURRENCY", 20))
+RATE_LIMIT = float(os.getenv("HERE_RATE_LIMIT", 20))
+TIMEOUT = 30
+MODES = ('transit', 'pedestrian', 'car', 'bicycle')
+
+
+class RateLimiter:
+    """Token bucket, lets `rate` requests start per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncRoutingClient:
+    """
+    Fires the transit, walk, drive and bike requests for a commute at the same time over one pooled
+    aiohttp session. transit_url and router_url can point at a local mock of the HERE API.
+
+    Requests for the same mode and cache cell share one HTTP call, whether the first is still in flight or
+    already answered. With a cache, commutes() reads every route it needs in one pipelined round trip before
+    fanning out and writes the new ones back in one after, both off the event loop.
+    """
+
+    def __init__(self, api_key, cache=None, concurrency=CONCURRENCY, rate_limit=RATE_LIMIT,
+                 transit_url=TRANSIT_URL, router_url=ROUTER_URL, timeout=TIMEOUT):
+        self.api_key = api_key
+        self.cache = cache
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.transit_url = transit_url
+        self.router_url = router_url
+        self.timeout = timeout
+        self.session = None
+        self.semaphore = None
+        self.limiter = None
+        # responses and in flight requests by cache key, for the life of the session
+        self.responses = {}
+        self.in_flight = {}
+        self.looked_up = set()
+        self.to_store = []
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.limiter = RateLimiter(self.rate_limit)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+
+    def _request(self, mode, origin, destination):
+        params = {'apikey': self.api_key,
+                  'origin': str(origin.latitude) + ',' + str(origin.longitude),
+                  'destination': str(destination.latitude) + ',' + str(destination.longitude)}
+        if mode == 'transit':
+            return self.transit_url, params
+        params['transportMode'] = mode
+        return self.router_url, params
+
+    def _key(self, mode, ends):
+        if self.cache is None:
+            return (mode,) + ends
+        return self.cache.key(mode, *ends)
+
+    async def _look_up(self, requests):
+        # requests are (mode, origin, destination), the redis round trip runs on the default executor
+        keys = [self._key(mode, ends) for mode, *ends in requests]
+        requests = [r for r, k in zip(requests, keys) if k not in self.looked_up]
+        self.looked_up.update(keys)
+        if len(requests) == 0:
+            return
+        cached = await asyncio.get_running_loop().run_in_executor(None, self.cache.get_many, requests)
+        self.responses.update((k, response) for k, response in cached.items() if response is not None)
+
+    async def _store(self):
+        if self.cache is None or len(self.to_store) == 0:
+            return
+        items, self.to_store = self.to_store, []
+        await asyncio.get_running_loop().run_in_executor(None, self.cache.set_many, items)
+
+    async def _get(self, mode, origin, destination):
+        url, params = self._request(mode, origin, destination)
+        async with self.semaphore:
+            await self.limiter.acquire()
+            async with self.session.get(url, params=params) as r:
+                r.raise_for_status()
+                return await r.json()
+
+    async def route(self, mode, origin, destination):
+        ends = ((origin.latitude, origin.longitude), (destination.latitude, destination.longitude))
+        key = self._key(mode, ends)
+        if self.cache is not None and key not in self.looked_up:
+            await self._look_up([(mode, *ends)])
+        if key in self.responses or key in self.in_flight:
+            if self.cache is not None:
+                self.cache.record(mode, hit=True)
+            if key in self.responses:
+                return self.responses[key]
+            return await asyncio.shield(self.in_flight[key])
+        if self.cache is not None:
+            self.cache.record(mode, hit=False)
+        request = self.in_flight[key] = asyncio.ensure_future(self._get(mode, origin, destination))
+        try:
+            response = await asyncio.shield(request)
+        finally:
+            del self.in_flight[key]
+        self.responses[key] = response
+        if self.cache is not None and is_cacheable(response):
+            self.to_store.append((mode, *ends, response))
+        return response
+
+    async def commute(self, origin, destination):
+        transit_route, walk_route, drive_route, bike_route = await asyncio.gather(
+            *[self.route(mode, origin, destination) for mode in MODES])
+        check_transit_route(transit_route, getattr(origin, 'address', None))
+        return build_commute(transit_route, walk_route, drive_route, bike_route)
+
+    async def commutes(self, pairs):
+        # one result per (origin, destination) pair, failures come back as the exception
+        if self.cache is not None:
+            await self._look_up([(mode, (o.latitude, o.longitude), (d.latitude, d.longitude))
+                                 for o, d in pairs for mode in MODES])
+        try:
+            return await asyncio.gather(*[self.commute(origin, destination) for origin, destination in pairs],
+                                        return_exceptions=True)
+        finally:
+            await self._store()
+
+
+async def fetch_commutes(pairs, api_key, cache=None, **kwargs):
+    async with AsyncRoutingClient(api_key, cache=cache, **kwargs) as client:
+        return await client.commutes(pairs)
@@ -0,0 +1,79 @@
+import json
+import os
+import sys
+import time
+
+from redis import Redis
+
+from src.bulk import DOWNTOWN, get_listing_field, mget_chunked
+from src.codec import decode_commute, decode_listing, decode_transactions, encode_commute, encode_listing, \
+    encode_transactions, is_encoded
+from src.listing_index import HONESTDOOR_SET_KEY, NAMESPACE, iter_listing_keys
+
+BENCHMARK_PREFIX = NAMESPACE + "benchmark/"
+SAMPLE_SIZE = 1000
+
+
+def _sample(redis, sample_size):
+    # legacy text values straight from redis, run before migrate_codec has rewritten them
+    listing_keys = []
+    for k in iter_listing_keys(redis):
+        listing_keys.append(k)
+        if len(listing_keys) >= sample_size:
+            break
+    listings = [v for v in get_listing_field(redis, listing_keys, "") if v is not None]
+    commutes = [v for v in get_listing_field(redis, listing_keys, DOWNTOWN) if v is not None and not is_encoded(v)]
+    properties = [p.decode() for p in redis.srandmember(HONESTDOOR_SET_KEY, sample_size)]
+    transactions = [v for v in mget_chunked(redis, [HONESTDOOR_SET_KEY + "/" + p for p in properties])
+                    if v is not None and not is_encoded(v)]
+    # listings can be rebuilt as json, the other two lose data once encoded so only legacy values count
+    legacy_listings = [json.dumps(decode_listing(v)).encode() for v in listings]
+    return {
+        "listing": (legacy_listings, [encode_listing(decode_listing(v)) for v in legacy_listings],
+                    json.loads, decode_listing),
+        "commute": (commutes, [encode_commute(decode_commute(v)) for v in commutes],
+                    decode_commute, decode_commute),
+        "transactions": (transactions, [encode_transactions(decode_transactions(v)) for v in transactions],
+                         decode_transactions, decode_transactions),
+    }
+
+
+def _memory(redis, values):
+    # MEMORY USAGE of the values stored under throwaway keys, includes redis' per key overhead
+    keys = [BENCHMARK_PREFIX + str(i) for i in range(len(values))]
+    pipe = redis.pipeline(transaction=False)
+    for k, v in zip(keys, values):
+        pipe.set(k, v)
+    for k in keys:
+        pipe.memory_usage(k, samples=0)
+    usage = pipe.execute()[len(keys):]
+    redis.delete(*keys)
+    return sum(usage)
+
+
+def _decode_seconds(values, decode):
+    start = time.perf_counter()
+    for v in values:
+        decode(v)
+    return time.perf_counter() - start
+
+
+def benchmark(redis: Redis, sample_size=SAMPLE_SIZE):
+    print(f"{'record':<14}{'n':>6}{'legacy bytes':>14}{'binary bytes':>14}{'legacy us':>11}{'binary us':>11}")
+    for name, (legacy, binary, decode_legacy, decode_binary) in _sample(redis, sample_size).items():
+        if not legacy:
+            print(f"{name:<14}{0:>6}  no legacy values to compare")
+            continue
+        n = len(legacy)
+        print(f"{name:<14}{n:>6}{_memory(redis, legacy) / n:>14.0f}{_memory(redis, binary) / n:>14.0f}"
+              f"{_decode_seconds(legacy, decode_legacy) / n * 1e6:>11.1f}"
+              f"{_decode_seconds(binary, decode_binary) / n * 1e6:>11.1f}")
+
+
+def main():
+    sample_size = int(sys.argv[1]) if len(sys.argv) > 1 else SAMPLE_SIZE
+    benchmark(Redis(host=os.getenv("REDIS_HOST", "10.20.40.57")), sample_size)
+
+
+if __name__ == "__main__":
+    main()
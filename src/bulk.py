@@ -0,0 +1,65 @@
+import os
+
+from redis import Redis
+
+# suffixes of the values derived from a listing, all stored at <listing key><suffix>
+LISTING = ""
+LATITUDE = "/latitude"
+LONGITUDE = "/longitude"
+DOWNTOWN = "/downtown"
+DOWNTOWN_COMMUTE_SCORE = "/downtown_commute_score"
+CUSTOM_COMMUTE_SCORE = "/custom_commute_score"
+TOTAL_SCORE = "/total_score"
+
+# keys per MGET / MSET / pipeline flush, large enough to amortize round trips and
+# small enough to keep a single reply from stalling redis
+CHUNK_SIZE = int(os.getenv("REDIS_CHUNK_SIZE", 1000))
+
+
+def chunks(items, chunk_size=CHUNK_SIZE):
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+
+def mget_chunked(redis: Redis, keys, chunk_size=CHUNK_SIZE):
+    keys = list(keys)
+    values = []
+    for chunk in chunks(keys, chunk_size):
+        values.extend(redis.mget(chunk))
+    return values
+
+
+def mset_pipelined(redis: Redis, items, chunk_size=CHUNK_SIZE):
+    # items is a dict or an iterable of (key, value) pairs
+    if isinstance(items, dict):
+        items = items.items()
+    pipe = redis.pipeline(transaction=False)
+    mapping = {}
+    for k, value in items:
+        mapping[k] = value
+        if len(mapping) >= chunk_size:
+            pipe.mset(mapping)
+            mapping = {}
+    if mapping:
+        pipe.mset(mapping)
+    pipe.execute()
+
+
+def smembers_chunked(redis: Redis, keys, chunk_size=CHUNK_SIZE):
+    keys = list(keys)
+    members = []
+    for chunk in chunks(keys, chunk_size):
+        pipe = redis.pipeline(transaction=False)
+        for k in chunk:
+            pipe.smembers(k)
+        members.extend(pipe.execute())
+    return members
+
+
+def get_listing_field(redis: Redis, listing_keys, suffix, chunk_size=CHUNK_SIZE):
+    return mget_chunked(redis, [k + suffix for k in listing_keys], chunk_size)
+
+
+def set_listing_field(redis: Redis, listing_keys, suffix, values, chunk_size=CHUNK_SIZE):
+    mset_pipelined(redis, ((k + suffix, value) for k, value in zip(listing_keys, values)), chunk_size)
+
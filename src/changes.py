@@ -0,0 +1,71 @@
+import logging
+import socket
+
+from redis import Redis
+from redis.exceptions import ResponseError
+
+from src.listing_index import NAMESPACE, listing_key
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# published by mls-polling for every listing whose json hash changed, fields key=<url key>, change=added|changed
+LISTING_CHANGES_STREAM = NAMESPACE + "listings_changes"
+# published by the downtown worker once a listing's commute data has been rewritten
+COMMUTE_CHANGES_STREAM = NAMESPACE + "commute_changes"
+
+STREAM_MAXLEN = 100000
+READ_COUNT = 500
+BLOCK_MS = 5000
+
+
+def ensure_group(redis: Redis, stream, group):
+    try:
+        # id 0 so a new worker group starts with everything still in the stream
+        redis.xgroup_create(stream, group, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def publish(redis: Redis, stream, url_keys, change="changed"):
+    pipe = redis.pipeline(transaction=False)
+    for url_key in url_keys:
+        pipe.xadd(stream, {"key": url_key, "change": change}, maxlen=STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+
+
+def read_changes(redis: Redis, stream, group, consumer, count=READ_COUNT, block=BLOCK_MS):
+    """
+    Next batch of entries for this consumer as (entry ids, {listing key: change}). Entries this consumer
+    read but never acknowledged, e.g. because it crashed, are handed back before new ones.
+    """
+    ids, changes = [], {}
+    for start in ("0", ">"):
+        response = redis.xreadgroup(group, consumer, {stream: start}, count=count,
+                                    block=None if start == "0" else block)
+        for _, entries in response:
+            for entry_id, fields in entries:
+                ids.append(entry_id)
+                if fields:
+                    changes[listing_key(fields[b"key"].decode())] = fields[b"change"].decode()
+        if ids:
+            break
+    return ids, changes
+
+
+def follow(redis: Redis, stream, group, handle, consumer=None, count=READ_COUNT, block=BLOCK_MS):
+    """
+    Run handle(changes) for every batch of changes published to stream, forever. A batch is only
+    acknowledged once handle returns, so a crash mid batch replays it on restart.
+    """
+    consumer = consumer or socket.gethostname()
+    ensure_group(redis, stream, group)
+    log.info("Following " + stream + " as " + group + "/" + consumer)
+    while True:
+        ids, changes = read_changes(redis, stream, group, consumer, count, block)
+        if not ids:
+            continue
+        if changes:
+            handle(changes)
+        redis.xack(stream, group, *ids)
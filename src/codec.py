@@ -0,0 +1,157 @@
+# Compact, versioned binary encoding for the records kept in redis.
+#
+# An encoded value is MAGIC, a record type byte, a schema version byte and a msgpack array of the fields in
+# schema order, so field names are not repeated per record. MAGIC is a byte msgpack never emits and that can
+# not start json or a python literal, so the decoders still read the legacy text values (pydantic json
+# listings, pandas to_json transactions and str(dict) commutes) while keys are migrated.
+#
+# Commutes from version 2 on are a fixed-width struct instead of msgpack, every field at a known offset, so a
+# single field can be unpacked (or fetched with GETRANGE) without decoding the rest. The raw HERE transit route
+# is not part of the commute record, encode_route keeps it as its own compressed value for when it is wanted.
+#
+# Shared with mls-polling, keep it free of imports from the rest of src.
+import ast
+import io
+import json
+import struct
+import zlib
+
+import msgpack
+
+MAGIC = b"\xc1"
+
+LISTING = 1
+TRANSACTIONS = 2
+COMMUTE = 3
+ROUTE = 4
+
+LISTING_FIELDS = {
+    1: ('address', 'lat', 'long', 'detail_url', 'price', 'id', 'mls_number', 'key', 'bathrooms', 'bedrooms',
+        'size', 'type', 'stories', 'lot_size', 'photo_url'),
+}
+# only what the scores need, the raw HERE transit route is dropped
+COMMUTE_FIELDS = {
+    1: ('transit_time', 'walk_time', 'drive_time', 'bike_time', 'transit_sections'),
+    2: ('transit_time', 'walk_time', 'drive_time', 'bike_time', 'transit_sections'),
+}
+# whole minutes and a section count, unsigned 16 bit little endian each
+COMMUTE_STRUCT = {
+    2: struct.Struct('<5H'),
+}
+HEADER_SIZE = 3
+LISTING_VERSION = max(LISTING_FIELDS)
+COMMUTE_VERSION = max(COMMUTE_FIELDS)
+TRANSACTIONS_VERSION = 1
+ROUTE_VERSION = 1
+
+
+class CodecError(ValueError):
+    pass
+
+
+def is_encoded(value):
+    # MAGIC is not valid utf-8, so a str is always a legacy text value
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:1]) == MAGIC
+
+
+def _pack(record_type, version, fields, default=None):
+    return MAGIC + bytes([record_type, version]) + msgpack.packb(fields, use_bin_type=True, default=default)
+
+
+def _unpack(value, record_type):
+    if value[1] != record_type:
+        raise CodecError(f"expected record type {record_type}, got {value[1]}")
+    return value[2], msgpack.unpackb(value[3:], raw=False)
+
+
+def encode_listing(listing: dict):
+    return _pack(LISTING, LISTING_VERSION, [listing.get(f) for f in LISTING_FIELDS[LISTING_VERSION]])
+
+
+def decode_listing(value):
+    if not is_encoded(value):
+        return json.loads(value)
+    version, fields = _unpack(value, LISTING)
+    if version not in LISTING_FIELDS:
+        raise CodecError(f"unknown listing schema version {version}")
+    return dict(zip(LISTING_FIELDS[version], fields))
+
+
+def compact_commute(commute: dict):
+    # a commute as built by location.build_commute, or a legacy one, reduced to COMMUTE_FIELDS
+    if 'transit_sections' in commute:
+        return {f: commute[f] for f in COMMUTE_FIELDS[COMMUTE_VERSION]}
+    return {'transit_time': commute['transit_time'], 'walk_time': commute['walk_time'],
+            'drive_time': commute['drive_time'], 'bike_time': commute['bike_time'],
+            'transit_sections': len(commute['transit_route']['routes'][0]['sections'])}
+
+
+def encode_commute(commute: dict):
+    compact = compact_commute(commute)
+    return MAGIC + bytes([COMMUTE, COMMUTE_VERSION]) + COMMUTE_STRUCT[COMMUTE_VERSION].pack(
+        *[compact[f] for f in COMMUTE_FIELDS[COMMUTE_VERSION]])
+
+
+def decode_commute(value):
+    if not is_encoded(value):
+        return compact_commute(ast.literal_eval(value.decode() if isinstance(value, bytes) else value))
+    if value[1] != COMMUTE:
+        raise CodecError(f"expected record type {COMMUTE}, got {value[1]}")
+    version = value[2]
+    if version in COMMUTE_STRUCT:
+        return dict(zip(COMMUTE_FIELDS[version], COMMUTE_STRUCT[version].unpack_from(value, HEADER_SIZE)))
+    if version not in COMMUTE_FIELDS:
+        raise CodecError(f"unknown commute schema version {version}")
+    return dict(zip(COMMUTE_FIELDS[version], msgpack.unpackb(value[HEADER_SIZE:], raw=False)))
+
+
+def commute_field_range(field, version=COMMUTE_VERSION):
+    # inclusive byte range of one field in a fixed-width commute, as GETRANGE takes it
+    fmt = COMMUTE_STRUCT[version]
+    size = struct.calcsize(fmt.format[-1])
+    start = HEADER_SIZE + COMMUTE_FIELDS[version].index(field) * size
+    return start, start + size - 1
+
+
+def decode_commute_field(value, field):
+    # one field of a commute, unpacked in place for fixed-width records
+    if is_encoded(value) and value[1] == COMMUTE and value[2] in COMMUTE_STRUCT:
+        start, end = commute_field_range(field, value[2])
+        return int.from_bytes(value[start:end + 1], 'little')
+    return decode_commute(value)[field]
+
+
+def encode_route(route: dict):
+    # the raw HERE response, only kept when asked for, so zlib over compact json
+    return MAGIC + bytes([ROUTE, ROUTE_VERSION]) + zlib.compress(json.dumps(route, separators=(',', ':')).encode())
+
+
+def decode_route(value):
+    if not is_encoded(value) or value[1] != ROUTE:
+        raise CodecError("not an encoded route")
+    if value[2] != ROUTE_VERSION:
+        raise CodecError(f"unknown route schema version {value[2]}")
+    return json.loads(zlib.decompress(value[HEADER_SIZE:]))
+
+
+def _isoformat(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"can not encode {type(value)}")
+
+
+def encode_transactions(df):
+    # column names once, then the rows, so a many sale history costs little more than a single sale
+    rows = df.astype(object).where(df.notna(), None).values.tolist()
+    return _pack(TRANSACTIONS, TRANSACTIONS_VERSION, [[str(c) for c in df.columns], rows], default=_isoformat)
+
+
+def decode_transactions(value):
+    # pandas is imported here so mls-polling, which never reads transactions, does not need it
+    import pandas as pd
+    if not is_encoded(value):
+        return pd.read_json(io.StringIO(value.decode() if isinstance(value, bytes) else value))
+    version, (columns, rows) = _unpack(value, TRANSACTIONS)
+    if version != TRANSACTIONS_VERSION:
+        raise CodecError(f"unknown transactions schema version {version}")
+    return pd.DataFrame(rows, columns=columns)
@@ -0,0 +1,91 @@
+import os
+import threading
+from typing import NamedTuple
+
+import pandas as pd
+from loguru import logger as log
+from redis import Redis
+
+from query import ListingQueryEngine
+from snapshot import SNAPSHOT_PATH, load_snapshot, refresh_snapshot
+
+# how often the refresh thread checks the snapshot file for a new version
+POLL_INTERVAL = int(os.getenv("SNAPSHOT_POLL_INTERVAL", 60))
+TABLE_DROP_COLUMNS = ['lat', 'long', 'easting', 'northing', 'detail_url', 'key', 'mls_number', 'id', 'photo_url']
+TABLE_COLUMNS = ['photo', 'price', 'DateSold', 'PriceLastSold', 'Assessment Price',
+                 'bedrooms', 'bathrooms', 'size', 'lot_size', 'type', 'stories']
+
+
+def table_frame(house_df):
+    # every listing, in house_df row order so query engine positions index it directly
+    display_df = house_df.drop(columns=[col for col in TABLE_DROP_COLUMNS if col in house_df.columns])
+    display_df['size'] = display_df['size'].apply(lambda x: x.split()[0] if x else -999).astype(float)
+    return display_df.set_index('address')[TABLE_COLUMNS]
+
+
+class ListingData(NamedTuple):
+    """One version of the listing snapshot and everything derived from it. Shared, never mutated."""
+    version: int
+    house_df: pd.DataFrame
+    query_engine: ListingQueryEngine
+    display_df: pd.DataFrame
+
+
+def listing_data(house_df, version):
+    return ListingData(version, house_df, ListingQueryEngine(house_df), table_frame(house_df))
+
+
+class ListingDataCache:
+    """
+    Process-wide holder of the current ListingData. panel serve re-runs main.py for every session, but this
+    module is imported once, so all sessions share one copy of the data instead of one each. A daemon thread
+    polls the snapshot file's mtime and swaps in a freshly loaded version; sessions keep the version they
+    started with until they ask for `current()` again, and old versions are freed once no session holds them.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, poll_interval=POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _version(self):
+        return os.stat(self.path).st_mtime_ns
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            # the snapshot job keeps the file fresh, only build it here on a first start
+            refresh_snapshot(Redis(host=os.getenv("REDIS_HOST", "10.30.40.132")), self.path)
+        version = self._version()
+        data = listing_data(load_snapshot(self.path), version)
+        log.info(f"Loaded listing snapshot version {version} with {len(data.house_df)} listings")
+        return data
+
+    def current(self) -> ListingData:
+        if self._current is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._load()
+                    self._start()
+        return self._current
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._poll, name="listing-snapshot-refresh", daemon=True)
+        self._thread.start()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self._version() != self._current.version:
+                    # built off to the side, sessions only ever see a complete version
+                    self._current = self._load()
+            except Exception as e:
+                log.error(f"Could not refresh listing snapshot: {e!r}")
+
+    def stop(self):
+        self._stop.set()
+
+
+listing_cache = ListingDataCache()
@@ -1,11 +1,18 @@
+import asyncio
 import logging
 import os
+import sys
 import traceback
 
 import redis
 from redis import Redis
 
-from src.location import geocode_destination_here, Location
+from src.async_routing import fetch_commutes
+from src.bulk import DOWNTOWN, LATITUDE, LONGITUDE, get_listing_field, mset_pipelined
+from src.changes import COMMUTE_CHANGES_STREAM, LISTING_CHANGES_STREAM, follow, publish
+from src.geocoding import resolve_locations
+from src.listing_index import iter_listing_keys, url_key_from_listing_key
+from src.location import API_KEY, commute_items, geocode_destination_here, Location, routing_cache
 from src.redis_locations import location_from_listing, set_latitude_longitude_listing
 
 log = logging.getLogger(__name__)
@@ -23,39 +30,64 @@ redis = Redis(host=os.getenv("REDIS_HOST", "10.20.40.57"))
 
 
 def add_downtown_to_all():
-    listings = redis.keys('house-search:listings/*')
+    listings = list(iter_listing_keys(redis))
     logging.info("Checking downtown data for "+str(len(listings))+" potential listings")
-    for i in listings:
-        k = i.decode()
-        if "latitude" in k or "longitude" in k or "/downtown" in k or "/poi/" in k or "score" in k:
-            pass
-            # these keys do not represent a listing
+    # one pass of MGETs to find the listings still missing downtown data
+    downtown = get_listing_field(redis, listings, DOWNTOWN)
+    missing = [k for k, value in zip(listings, downtown) if value is None]
+    add_downtown_to_listings(missing)
+
+
+def add_downtown_to_listings(listing_keys, refresh=False):
+    """
+    Compute and store downtown commutes for listing_keys, returns the keys that were written.
+    refresh drops the stored coordinates first so a listing that moved is routed from its new position.
+    """
+    if len(listing_keys) == 0:
+        return []
+    if refresh:
+        redis.delete(*[k + suffix for k in listing_keys for suffix in (LATITUDE, LONGITUDE)])
+    # stored coordinates first, geocoding only what has never been resolved
+    locations = list(resolve_locations(redis, listing_keys).values())
+
+    # every listing's four routing calls run concurrently, bounded by HERE_CONCURRENCY
+    results = asyncio.run(fetch_commutes([(l, dt_loc) for l in locations], API_KEY, cache=routing_cache))
+    items, written = [], []
+    for l, result in zip(locations, results):
+        if isinstance(result, Exception):
+            log.error("Downtown commute failed for " + l.listing_key + ": " + repr(result))
         else:
-            try:
-                if redis.get(k + "/downtown") is None:
-                    lat = redis.get(k + "latitude")
-                    if lat is None:
-                        l = location_from_listing(k, redis)
-                    else:
-                        l = Location(latitude=lat, longitude=redis.get(k + "longitude"))
-                    data = l.get_point_of_interest_data(dt_loc)
-                    redis.set(k + "/downtown", str(data['commute']))
-            except Exception as e:
-                log.exception(traceback.format_exc())
+            written.append(l.listing_key)
+            items.extend(commute_items(l.listing_key + DOWNTOWN, result))
+    mset_pipelined(redis, items)
+    routing_cache.flush_stats()
+    return written
+
+
+def handle_listing_changes(changes):
+    # changed listings may have moved, added ones have nothing stored yet
+    refreshed = add_downtown_to_listings([k for k, change in changes.items() if change == "changed"], refresh=True)
+    added = add_downtown_to_listings([k for k, change in changes.items() if change != "changed"])
+    publish(redis, COMMUTE_CHANGES_STREAM, [url_key_from_listing_key(k) for k in refreshed + added])
+    log.info("Updated downtown data for " + str(len(refreshed) + len(added)) + " of " + str(len(changes))
+             + " changed listings")
 
 
 def add_downtown_to_one(location):
     try:
         data = location.get_point_of_interest_data(dt_loc)
-        redis.set(location.listing_key + "/downtown", str(data['commute']))
+        redis.mset(dict(commute_items(location.listing_key + "/downtown", data['commute'])))
     except Exception as e:
         print(e)
 
 
-def main():
+def main(follow_changes=False):
+    if follow_changes:
+        # only touch listings mls-polling reports as added or changed
+        follow(redis, LISTING_CHANGES_STREAM, "downtown", handle_listing_changes)
     # default behaviour is to add to all
     add_downtown_to_all()
 
 
 if __name__ == "__main__":
-    main()
+    main(follow_changes="--follow" in sys.argv)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import re
+
+import aiohttp
+
+from src.async_routing import RateLimiter
+from src.location import API_KEY, URL, Location
+from src.redis_locations import get_latitude_longitude_listings, listings_from_keys, set_latitude_longitude_listings
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+# hash of normalized address -> "lat,long", shared by every job that geocodes
+GEOCODE_CACHE_KEY = "house-search:geocode"
+
+GEOCODE_CONCURRENCY = int(os.getenv("GEOCODE_CONCURRENCY", 5))
+GEOCODE_RATE_LIMIT = float(os.getenv("GEOCODE_RATE_LIMIT", 5))
+
+
+def normalize_address(address):
+    # realtor.ca addresses look like "123 Main St SW|Calgary, Alberta T2X1Y1"
+    address = address.replace("|", ", ").lower()
+    address = re.sub(r"[^\w\s,]", " ", address)
+    address = re.sub(r"\s*,\s*", ", ", address)
+    return re.sub(r"\s+", " ", address).strip(" ,")
+
+
+def _coordinates(value):
+    lat, long = value.decode().split(",") if isinstance(value, bytes) else value.split(",")
+    return float(lat), float(long)
+
+
+async def _geocode(session, semaphore, limiter, address, api_key, url):
+    async with semaphore:
+        await limiter.acquire()
+        async with session.get(url, params={"q": address, "apiKey": api_key}) as r:
+            r.raise_for_status()
+            response = await r.json()
+    if len(response.get("items", [])) == 0:
+        raise Exception(address + " is returning an empty result! Consider removing.")
+    position = response["items"][0]["position"]
+    return position["lat"], position["lng"]
+
+
+async def geocode_many(addresses, api_key=API_KEY, concurrency=GEOCODE_CONCURRENCY, rate_limit=GEOCODE_RATE_LIMIT,
+                       url=URL):
+    # one (lat, long) or exception per address
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_limit)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        return await asyncio.gather(*[_geocode(session, semaphore, limiter, a, api_key, url) for a in addresses],
+                                    return_exceptions=True)
+
+
+def resolve_locations(redis, listing_keys, **geocode_kwargs):
+    """
+    Locations for listings, taken in order from the stored /latitude and /longitude keys, the lat/long in the
+    listing json, the normalized address cache and finally the HERE geocoder. Anything not already stored is
+    written back, so each address is geocoded at most once. Listings that cannot be resolved are left out.
+    """
+    listing_keys = list(listing_keys)
+    stored = get_latitude_longitude_listings(listing_keys, redis)
+    listings = listings_from_keys(listing_keys, redis)
+
+    coordinates = {}
+    addresses = {}
+    for k, point, listing in zip(listing_keys, stored, listings):
+        if listing is not None:
+            addresses[k] = listing.get("address")
+        if point is not None:
+            coordinates[k] = point
+        elif listing is not None and listing.get("lat") is not None and listing.get("long") is not None:
+            coordinates[k] = (float(listing["lat"]), float(listing["long"]))
+    from_store = set(k for k, point in zip(listing_keys, stored) if point is not None)
+
+    unresolved = [k for k in listing_keys if k not in coordinates and addresses.get(k)]
+    normalized = {k: normalize_address(addresses[k]) for k in unresolved}
+    wanted = sorted(set(normalized.values()))
+    cached = dict(zip(wanted, redis.hmget(GEOCODE_CACHE_KEY, wanted))) if wanted else {}
+
+    misses = [a for a in wanted if cached[a] is None]
+    if misses:
+        log.info("Geocoding " + str(len(misses)) + " addresses")
+        geocoded = {}
+        for address, result in zip(misses, asyncio.run(geocode_many(misses, **geocode_kwargs))):
+            if isinstance(result, Exception):
+                log.error("Geocoding failed for " + address + ": " + repr(result))
+            else:
+                geocoded[address] = result
+        if geocoded:
+            redis.hset(GEOCODE_CACHE_KEY, mapping={a: f"{lat},{long}" for a, (lat, long) in geocoded.items()})
+        cached.update(geocoded)
+
+    for k in unresolved:
+        value = cached.get(normalized[k])
+        if value is not None:
+            coordinates[k] = value if isinstance(value, tuple) else _coordinates(value)
+
+    locations = {}
+    for k, (lat, long) in coordinates.items():
+        l = Location(latitude=lat, longitude=long, listing_key=k)
+        l.address = addresses.get(k)
+        locations[k] = l
+    set_latitude_longitude_listings([l for k, l in locations.items() if k not in from_store], redis)
+    return locations
@@ -0,0 +1,86 @@
+import logging
+import os
+
+from redis import Redis
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+NAMESPACE = "house-search:"
+LISTING_COLLECTION_KEY = "listings"
+
+# set of listing url keys, maintained by mls-polling on every store
+LISTING_SET_KEY = NAMESPACE + LISTING_COLLECTION_KEY
+LISTING_PREFIX = LISTING_SET_KEY + "/"
+POI_INDEX_SUFFIX = "/pois"
+# set of url keys with scraped HonestDoor transactions, stored at <HONESTDOOR_SET_KEY>/<url key>
+HONESTDOOR_SET_KEY = NAMESPACE + "listings_honestdoor"
+# raw HERE transit routes, kept apart from the commute records and off the listing keyspace the index backfill scans
+ROUTE_PREFIX = NAMESPACE + "commute_routes/"
+# the scores only need the commute record, the full transit route is kept only when this is set
+STORE_ROUTES = os.getenv("STORE_COMMUTE_ROUTES", "0") == "1"
+
+SCAN_COUNT = 1000
+
+
+def listing_key(url_key):
+    return LISTING_PREFIX + url_key
+
+
+def url_key_from_listing_key(key):
+    return key[len(LISTING_PREFIX):]
+
+
+def poi_index_key(key):
+    # set of /poi/ keys hanging off a listing
+    return key + POI_INDEX_SUFFIX
+
+
+def route_key(commute_key):
+    return ROUTE_PREFIX + commute_key[len(NAMESPACE):]
+
+
+def iter_listing_keys(redis: Redis, count=SCAN_COUNT):
+    # SSCAN walks the index in small steps so redis is never blocked on a big reply
+    for member in redis.sscan_iter(LISTING_SET_KEY, count=count):
+        yield listing_key(member.decode())
+
+
+def iter_poi_keys(redis: Redis, key, count=SCAN_COUNT):
+    for member in redis.sscan_iter(poi_index_key(key), count=count):
+        yield member.decode()
+
+
+def add_poi(redis: Redis, key, poi_key):
+    redis.sadd(poi_index_key(key), poi_key)
+
+
+def rebuild_listing_index(redis: Redis, count=SCAN_COUNT):
+    """
+    One-off backfill of the listing and poi index sets from the keyspace, for data written before
+    the indexes existed. Uses SCAN rather than KEYS so it is safe to run against a live server.
+    """
+    listings = pois = 0
+    pipe = redis.pipeline(transaction=False)
+    for raw in redis.scan_iter(match=LISTING_PREFIX + "*", count=count):
+        k = raw.decode()
+        rest = url_key_from_listing_key(k)
+        if "/" not in rest:
+            pipe.sadd(LISTING_SET_KEY, rest)
+            listings += 1
+        elif "/poi/" in rest:
+            pipe.sadd(poi_index_key(k.split("/poi/")[0]), k)
+            pois += 1
+        if len(pipe) >= count:
+            pipe.execute()
+    pipe.execute()
+    log.info("Indexed " + str(listings) + " listings and " + str(pois) + " points of interest")
+    return listings, pois
+
+
+def main():
+    rebuild_listing_index(Redis(host=os.getenv("REDIS_HOST", "10.20.40.57")))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,10 @@ from datetime import datetime
 import requests
 from redis import Redis
 
+from src.codec import encode_commute, encode_route
+from src.listing_index import STORE_ROUTES, add_poi, route_key
+from src.routing_cache import RoutingCache
+
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
@@ -14,10 +18,11 @@ URL = "https://geocode.search.hereapi.com/v1/geocode"
 API_KEY = os.environ["HERE_API_KEY"]
 
 redis = Redis(host=os.getenv("REDIS_HOST", "10.20.40.57"))
+routing_cache = RoutingCache(redis)
 
 
 def location_id_format(longitude: float, latitude: float):
-    # this would be a good place to round
+    # route lookups round through routing_cache.grid_cell, this id stays exact so poi keys are stable
     return "long_" + str(longitude) + "_lat_" + str(latitude)
 
 
@@ -32,6 +37,7 @@ class Location:
             self.latitude = response['items'][0]['position']['lat']
             self.mapview = response['items'][0]['mapView']
         else:
+            self.address = None
             self.longitude = longitude
             self.latitude = latitude
 
@@ -42,35 +48,17 @@ class Location:
 
     def add_point_of_interest(self, location):
         transit_route = transit_routes(self, location)
-        time = transit_time(transit_route['routes'][0])
-        walk_time = transit_time(walk(self, location)['routes'][0])
-        drive_time = transit_time(drive(self, location)['routes'][0])
-        bike_time = transit_time(bike(self, location)['routes'][0])
-        commute = {'transit_route': transit_route, 'transit_time': time,
-                   'walk_time': walk_time,
-                   'drive_time': drive_time,
-                   'bike_time': bike_time}
+        commute = build_commute(transit_route, walk(self, location), drive(self, location), bike(self, location))
         data = {'location': location, 'commute': commute}
-        redis.set(self.listing_key + "/poi/" + location.id, str(data['commute']))
+        poi_key = self.listing_key + "/poi/" + location.id
+        redis.mset(dict(commute_items(poi_key, data['commute'])))
+        add_poi(redis, self.listing_key, poi_key)
         self.points_of_interest.append(data)
 
     def get_point_of_interest_data(self, location):
         transit_route = transit_routes(self, location)
-        if 'notices' in transit_route:
-            if transit_route['notices'][0][
-                'title'] == 'Routing is not possible due to missing stations in a given range':
-                message = "Ensure locations are in the same city."
-                if self.address is not None:
-                    message = message + " Check that " + self.address + " is a valid location"
-                raise Exception(message)
-        time = transit_time(transit_route['routes'][0])
-        walk_time = transit_time(walk(self, location)['routes'][0])
-        drive_time = transit_time(drive(self, location)['routes'][0])
-        bike_time = transit_time(bike(self, location)['routes'][0])
-        commute = {'transit_route': transit_route, 'transit_time': time,
-                   'walk_time': walk_time,
-                   'drive_time': drive_time,
-                   'bike_time': bike_time}
+        check_transit_route(transit_route, self.address)
+        commute = build_commute(transit_route, walk(self, location), drive(self, location), bike(self, location))
         data = {'location': location, 'commute': commute}
         return data
 
@@ -81,6 +69,31 @@ class Location:
             return False
 
 
+def commute_items(key, commute, store_route=STORE_ROUTES):
+    # (key, value) pairs to write for a commute: the record, and the raw transit route beside it if wanted
+    items = [(key, encode_commute(commute))]
+    if store_route:
+        items.append((route_key(key), encode_route(commute['transit_route'])))
+    return items
+
+
+def check_transit_route(transit_route, address=None):
+    if 'notices' in transit_route:
+        if transit_route['notices'][0][
+            'title'] == 'Routing is not possible due to missing stations in a given range':
+            message = "Ensure locations are in the same city."
+            if address is not None:
+                message = message + " Check that " + address + " is a valid location"
+            raise Exception(message)
+
+
+def build_commute(transit_route, walk_route, drive_route, bike_route):
+    return {'transit_route': transit_route, 'transit_time': transit_time(transit_route['routes'][0]),
+            'walk_time': transit_time(walk_route['routes'][0]),
+            'drive_time': transit_time(drive_route['routes'][0]),
+            'bike_time': transit_time(bike_route['routes'][0])}
+
+
 def geocode_destination_here(x: str):
     log.info(f"Geocoding query : {x}")
     payload = {"q": x, "apiKey": API_KEY}
@@ -90,11 +103,18 @@ def geocode_destination_here(x: str):
     return r.json()
 
 
+def _route(mode, url, spot1: Location, spot2: Location, params):
+    def request():
+        r = requests.get(url=url, params=params)
+        return r.json()
+
+    return routing_cache.fetch(mode, (spot1.latitude, spot1.longitude), (spot2.latitude, spot2.longitude), request)
+
+
 def transit_routes(spot1: Location, spot2: Location):
     data = {'apikey': API_KEY, 'origin': str(spot1.latitude) + ',' + str(spot1.longitude),
             'destination': str(spot2.latitude) + ',' + str(spot2.longitude)}
-    r = requests.get(url='https://transit.router.hereapi.com/v8/routes', params=data)
-    return r.json()
+    return _route('transit', 'https://transit.router.hereapi.com/v8/routes', spot1, spot2, data)
 
 
 def transit_time(route):
@@ -112,21 +132,18 @@ def walk(spot1: Location, spot2: Location):
     data = {'apikey': API_KEY, 'origin': str(spot1.latitude) + ',' + str(spot1.longitude),
             'destination': str(spot2.latitude) + ',' + str(spot2.longitude),
             'transportMode': 'pedestrian'}
-    r = requests.get(url='https://router.hereapi.com/v8/routes', params=data)
-    return r.json()
+    return _route('pedestrian', 'https://router.hereapi.com/v8/routes', spot1, spot2, data)
 
 
 def drive(spot1: Location, spot2: Location):
     data = {'apikey': API_KEY, 'origin': str(spot1.latitude) + ',' + str(spot1.longitude),
             'destination': str(spot2.latitude) + ',' + str(spot2.longitude),
             'transportMode': 'car'}
-    r = requests.get(url='https://router.hereapi.com/v8/routes', params=data)
-    return r.json()
+    return _route('car', 'https://router.hereapi.com/v8/routes', spot1, spot2, data)
 
 
 def bike(spot1: Location, spot2: Location):
     data = {'apikey': API_KEY, 'origin': str(spot1.latitude) + ',' + str(spot1.longitude),
             'destination': str(spot2.latitude) + ',' + str(spot2.longitude),
             'transportMode': 'bicycle'}
-    r = requests.get(url='https://router.hereapi.com/v8/routes', params=data)
-    return r.json()
+    return _route('bicycle', 'https://router.hereapi.com/v8/routes', spot1, spot2, data)
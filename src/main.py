@@ -1,20 +1,19 @@
-import json
 import holoviews as hv
 import numpy as np
 import pandas as pd
 import panel as pn
 import param
-from bokeh.models import HoverTool, ResetTool, PanTool, WheelZoomTool, ColumnDataSource
+from bokeh.models import HoverTool, ResetTool, PanTool, WheelZoomTool, ColumnDataSource, LogColorMapper
+from bokeh.palettes import Blues9
 from bokeh.plotting import figure
-from holoviews.util.transform import lon_lat_to_easting_northing, easting_northing_to_lon_lat
-from redis_dict import RedisDict
-from tqdm import tqdm
+from holoviews.util.transform import easting_northing_to_lon_lat
 from loguru import logger as log
+from aggregation import GRID_BINS, POINT_THRESHOLD, grid_bins, in_viewport
 from constants import CSS_CLASS_CARD
-from utils import get_price_range, OSM_tile_source
+from data_cache import POLL_INTERVAL, listing_cache
+from utils import OSM_tile_source
 from bokeh.models.widgets.tables import HTMLTemplateFormatter, NumberFormatter
 
-r_dic = RedisDict(namespace='house-search', host="10.30.40.132")
 bootstrap = pn.template.BootstrapTemplate(title='Smart House Search')
 pn.config.sizing_mode = "stretch_width"
 pn.extension(raw_css=[CSS_CLASS_CARD])
@@ -36,56 +35,36 @@ TOOLTIPS = """
         </div>
     </div>
 """
-HONESTDOOR_COLS = ['DateSold', 'PriceLastSold', 'property_id', 'Assessment Price']
 
+BIN_TOOLTIPS = [('Listings', '@count'), ('Median price', '$@median_price{0,0}')]
+# what the circles and TOOLTIPS read, the only columns sent to the browser
+MAP_COLUMNS = ['easting', 'northing', 'photo', 'address', 'size', 'price']
+BIN_COLUMNS = ['x', 'y', 'width', 'height', 'count', 'median_price']
+# ms to let the range changes of one pan or zoom arrive before the map is redrawn once for all of them
+VIEWPORT_DEBOUNCE = 100
 
-def pull_redis(redis_client):
-    dataframes = []
-    listings_honestdoor_addresses = redis_client.smembers('%s:listings_honestdoor' % namespace)
-    # Pull realtorca records
-    for a in tqdm(list(listings_honestdoor_addresses)[:10]):
-        # log.info(a)
-        key_to_data = f'{namespace}:listings/{a}'
-        key_to_hd_data = f'{namespace}:listings_honestdoor/{a}'
-        log.info(key_to_data)
 
+def filter_options(house_df):
+    # what the sidebar filters can choose from for one version of the listing data
+    options = {}
+    options['type'] = list(house_df['type'].unique())
+    options['price_max'] = house_df['price'].max()
+    options['price_min'] = house_df['price'].min()
+    options['transit_time_max'] = 180
+    return options
 
-        listing_data = pd.DataFrame(json.loads(r_dic.redis.get(key_to_data)), index=[a])
-        honestdoor_data = pd.read_json(r_dic.redis.get(key_to_hd_data))
-        honestdoor_data.columns = HONESTDOOR_COLS
-        honestdoor_data.index = [a] * honestdoor_data.shape[0]
-        merged_data = pd.concat([listing_data, honestdoor_data.head(1)], axis=1)
-        dataframes.append(merged_data)
-    df = pd.concat(dataframes)
-    df['photo'] = df['photo_url']
-    df['DateSold'] = df['DateSold'].dt.date
-    df['address'] = df['address'].apply(lambda x: x.split('|')[0])
 
-    df.drop(columns='photo_url', inplace=True)
-
-    return df
-
-
-namespace = 'house-search'
-house_df_default = pull_redis(r_dic.redis)
-options = {}
-options['type'] = list(house_df_default['type'].unique())
-options['price_max'] = house_df_default['price'].max()
-options['price_min'] = house_df_default['price'].min()
-
-options['transit_time_max'] = 180
+# shared by every session in the process, see data_cache
+house_df_default = listing_cache.current().house_df
+options = filter_options(house_df_default)
 
 class ReactiveDashboard(param.Parameterized):
     title = pn.pane.Markdown("# Smart House Search")
     pins = param.List(default=[])
     lat_longs = param.List(default=[])
     # house_df = get_dummy_house_df()
-    house_df = house_df_default
     hover = HoverTool(tooltips=TOOLTIPS)
     details_area = pn.pane.Markdown("# Details")
-    price_range = get_price_range()
-    minimum_price = param.Selector(objects=list(price_range))
-    maximum_price = param.Selector(objects=list(price_range), default=price_range[-1])
     price_slider = param.Range(label='Price range',
                                default=(options['price_min'], options['price_max']), bounds=(0, options['price_max']),
                                )
@@ -101,32 +80,105 @@ class ReactiveDashboard(param.Parameterized):
     map_background = hv.element.tiles.OSM().opts(width=600, height=550)
     stream = hv.streams.Tap(source=map_background, x=np.nan, y=np.nan)
 
-    def get_easting_northing(self):
-        self.house_df['easting'] = self.house_df.apply(lambda x: lon_lat_to_easting_northing(x['long'], x['lat'])[0],
-                                                       axis=1)
-        self.house_df['northing'] = self.house_df.apply(lambda x: lon_lat_to_easting_northing(x['long'], x['lat'])[1],
-                                                        axis=1)
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.use_data(listing_cache.current())
+        self.refresh_button = pn.widgets.Button(name='Load new listings', button_type='primary', visible=False)
+        self.refresh_button.on_click(self.load_new_data)
+        # one figure per session, the sources only ever hold what is drawn in the current viewport:
+        # the listings themselves when there are few enough of them, grid cells otherwise
+        self.house_source = ColumnDataSource({c: [] for c in MAP_COLUMNS})
+        self.bin_source = ColumnDataSource({c: [] for c in BIN_COLUMNS})
+        self.figure = self.house_plot()
+        self.map_pane = pn.pane.Bokeh(self.figure)
+        self.table = None
+        self.viewport_pending = False
+        self.update_map()
+        for map_range in [self.figure.x_range, self.figure.y_range]:
+            map_range.on_change('start', self.viewport_changed)
+            map_range.on_change('end', self.viewport_changed)
+
+    def use_data(self, data):
+        # the session's version of the shared listing data, only replaced when the user asks for it
+        self.data = data
+        self.house_df = data.house_df
+        self.query_engine = data.query_engine
+        self.display_df = data.display_df
+        self.easting = self.house_df['easting'].to_numpy()
+        self.northing = self.house_df['northing'].to_numpy()
+        self.price = self.house_df['price'].to_numpy(dtype=float)
+
+    def check_data_version(self):
+        self.refresh_button.visible = listing_cache.current().version != self.data.version
+
+    def load_new_data(self, event):
+        old_options = filter_options(self.house_df)
+        self.use_data(listing_cache.current())
+        self.refresh_button.visible = False
+        if not self.use_filter_options(old_options, filter_options(self.house_df)):
+            # the filters did not move, so nothing else refreshes the map and table for the new data
+            self.update_house_filter()
+
+    def use_filter_options(self, old, new):
+        # types the user never saw start selected, a price range left open at the old maximum follows the new one
+        types = [t for t in self.type if t in new['type']] + [t for t in new['type'] if t not in old['type']]
+        low, high = self.price_slider
+        high = new['price_max'] if high >= old['price_max'] else min(high, new['price_max'])
+        self.param.type.objects = new['type']
+        self.param.type.default = new['type']
+        self.param.price_slider.bounds = (0, new['price_max'])
+        self.param.price_slider.default = (new['price_min'], new['price_max'])
+        price = (min(low, high), high)
+        changed = types != list(self.type) or price != tuple(self.price_slider)
+        self.param.set_param(type=types, price_slider=price)
+        return changed
+
+    def filtered_indices(self):
+        # listings without a downtown commute stay on the map until the transit range is narrowed
+        transit_time = self.transit_time
+        if tuple(transit_time) == self.param.transit_time.bounds:
+            transit_time = None
+        return self.query_engine.query(price=self.price_slider, transit_time=transit_time,
+                                       bedrooms=self.rooms_slider, bathrooms=self.bathrooms_slider, types=self.type)
+
+    @pn.depends('price_slider', 'rooms_slider', 'bathrooms_slider', 'type', 'transit_time', watch=True)
+    def update_house_filter(self):
+        self.update_map()
+        if self.table is not None:
+            self.table.value = self.display_df.iloc[self.filtered_indices()]
+
+    def viewport_changed(self, attr, old, new):
+        # start and end of both ranges each report a pan or zoom, only the first schedules a redraw
+        if pn.state.curdoc is None:
+            self.update_map()
+            return
+        if not self.viewport_pending:
+            self.viewport_pending = True
+            pn.state.curdoc.add_timeout_callback(self.viewport_settled, VIEWPORT_DEBOUNCE)
+
+    def viewport_settled(self):
+        self.viewport_pending = False
+        self.update_map()
+
+    def update_map(self):
+        x_range = (self.figure.x_range.start, self.figure.x_range.end)
+        y_range = (self.figure.y_range.start, self.figure.y_range.end)
+        indices = self.filtered_indices()
+        indices = indices[in_viewport(self.easting[indices], self.northing[indices], x_range, y_range)]
+        if len(indices) <= POINT_THRESHOLD:
+            self.house_source.data = ColumnDataSource.from_df(self.house_df.iloc[indices][MAP_COLUMNS])
+            self.bin_source.data = {c: [] for c in BIN_COLUMNS}
+        else:
+            self.house_source.data = {c: [] for c in MAP_COLUMNS}
+            self.bin_source.data = grid_bins(self.easting[indices], self.northing[indices], self.price[indices],
+                                             x_range, y_range, GRID_BINS)
 
-    @pn.depends('price_slider', 'rooms_slider', 'bathrooms_slider', 'pins', watch=False)
     def house_plot(self):
-
-        if 'northing' not in self.house_df.columns:
-            self.get_easting_northing()
-
-        df_filtered = self.house_df[
-            (self.house_df['price'] <= self.price_slider[1]) & (self.house_df['price'] >= self.price_slider[0])]
-        df_filtered = df_filtered[
-            (df_filtered['bedrooms'] <= self.rooms_slider[1]) & (df_filtered['bedrooms'] >= self.rooms_slider[0])]
-        df_filtered = df_filtered[
-            (df_filtered['bathrooms'] <= self.rooms_slider[1]) & (df_filtered['bathrooms'] >= self.rooms_slider[0])]
-        # Create a bokeh figure and source here:
-
-        # range bounds supplied in web mercator coordinates
-        xrange = (df_filtered['easting'].round(decimals=2).min(),
-                  df_filtered['easting'].round(decimals=2).max())
-        yrange = (df_filtered['northing'].round(decimals=2).min(),
-                  df_filtered['northing'].round(decimals=2).max())
-        df_source = ColumnDataSource(df_filtered)
+        # range bounds supplied in web mercator coordinates, the user's pan/zoom is kept after that
+        xrange = (self.house_df['easting'].round(decimals=2).min(),
+                  self.house_df['easting'].round(decimals=2).max())
+        yrange = (self.house_df['northing'].round(decimals=2).min(),
+                  self.house_df['northing'].round(decimals=2).max())
         tools = [ResetTool(), PanTool(), WheelZoomTool()]
         p = figure(x_range=xrange,
                    y_range=yrange,
@@ -135,14 +187,19 @@ class ReactiveDashboard(param.Parameterized):
                    tools=tools
                    )
         p.add_tile(OSM_tile_source)
-        print(df_filtered.shape)
+        bin_renderer = p.rect(x='x', y='y', width='width', height='height',
+                              fill_color={'field': 'count', 'transform': LogColorMapper(palette=Blues9[::-1])},
+                              fill_alpha=0.6,
+                              line_width=0,
+                              source=self.bin_source)
+        p.add_tools(HoverTool(renderers=[bin_renderer], tooltips=BIN_TOOLTIPS))
         circle_renderer = p.circle(x='easting', y='northing',
                                    fill_color='midnightblue',
                                    fill_alpha=0.95,
                                    line_color='dodgersblue',
                                    hover_fill_color='firebrick',
                                    line_alpha=0.91,
-                                   source=df_source,
+                                   source=self.house_source,
                                    size=10,
                                    # hover_line_color='black',
                                    line_width=0)
@@ -151,22 +208,6 @@ class ReactiveDashboard(param.Parameterized):
         p.add_tools(tool_circle_hover)
         return p
 
-    def filter_df(self):
-        if 'northing' not in self.house_df.columns:
-            self.get_easting_northing()
-
-        display_df = self.house_df[
-            (self.house_df['price'] <= self.maximum_price) & (self.house_df['price'] >= self.minimum_price)]
-        cols = ['lat', 'long', 'easting', 'northing', 'detail_url', 'key', 'mls_number', 'id', 'photo_url']
-        for col in cols:
-            if col in display_df.columns:
-                display_df = display_df.drop(columns=col, axis=1)
-        display_df['size'] = display_df['size'].apply(lambda x: x.split()[0] if x else -999).astype(float)
-        display_df = display_df.set_index('address')
-
-        return display_df[['photo', 'price', 'DateSold', 'PriceLastSold', 'Assessment Price',
-                           'bedrooms', 'bathrooms', 'size', 'lot_size', 'type', 'stories']]
-
     @pn.depends("stream", watch=False)
     def distance_df(self, x, y):
         lat = easting_northing_to_lon_lat(x, y)[1]
@@ -180,11 +221,12 @@ class ReactiveDashboard(param.Parameterized):
     def location(self, x, y):
         if x and y:
             self.pins.append([x, y])
-        return self.house_plot
+        return self.map_pane
 
     def panel(self):
         result = bootstrap
         price_slider = pn.widgets.RangeSlider.from_param(self.param.price_slider, step=10000,format='0.0a')
+        result.sidebar.append(self.refresh_button)
         result.sidebar.append(price_slider)
         result.sidebar.append(self.param.rooms_slider)
         result.sidebar.append(self.param.bathrooms_slider)
@@ -199,10 +241,10 @@ class ReactiveDashboard(param.Parameterized):
             'photo': HTMLTemplateFormatter(template=image_format)
         }
 
-        df_widget = pn.widgets.Tabulator(self.filter_df(), pagination='remote', page_size=10,
-                                         formatters=tabulator_formatters, sizing_mode='scale_both')
-        df_widget.add_filter(self.param.price_slider, 'price')
-        df_widget.add_filter(self.param.rooms_slider, 'bedrooms')
+        df_widget = pn.widgets.Tabulator(self.display_df.iloc[self.filtered_indices()], pagination='remote',
+                                         page_size=10, formatters=tabulator_formatters, sizing_mode='scale_both')
+        self.table = df_widget
+        pn.state.add_periodic_callback(self.check_data_version, period=POLL_INTERVAL * 1000)
 
         # df_pins = pn.widgets.Tabulator(self.distance_df(), pagination='remote', page_size=10, sizing_mode='scale_both')
 
@@ -0,0 +1,89 @@
+import ast
+import logging
+import os
+import sys
+
+from redis import Redis
+
+from src.bulk import CHUNK_SIZE, DOWNTOWN, chunks, get_listing_field, mget_chunked, mset_pipelined, smembers_chunked
+from src.codec import decode_commute, decode_listing, decode_transactions, encode_commute, encode_listing, \
+    encode_route, encode_transactions, is_encoded
+from src.listing_index import HONESTDOOR_SET_KEY, STORE_ROUTES, iter_listing_keys, poi_index_key, route_key
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+def legacy_route(k, value):
+    # a legacy str(dict) commute is the last place its raw transit route exists, keep it if routes are kept
+    if is_encoded(value):
+        return []
+    commute = ast.literal_eval(value.decode() if isinstance(value, bytes) else value)
+    return [(route_key(k), encode_route(commute['transit_route']))]
+
+
+def _migrate_values(redis, keys, values, convert, dry_run, extra=None):
+    # rewrites the values not already in the current encoding, returns (converted, bytes before, bytes after);
+    # extra(key, value) gives more (key, value) pairs to write next to a converted value
+    items, converted, before, after = [], 0, 0, 0
+    for k, value in zip(keys, values):
+        if value is None:
+            continue
+        try:
+            encoded = convert(value)
+            if encoded == value:
+                continue
+            if extra is not None:
+                items.extend(extra(k, value))
+        except Exception as e:
+            log.error("Could not convert " + k + ": " + repr(e))
+            continue
+        items.append((k, encoded))
+        converted += 1
+        before += len(value)
+        after += len(encoded)
+    if not dry_run:
+        mset_pipelined(redis, items)
+    return converted, before, after
+
+
+def migrate(redis: Redis, dry_run=False, chunk_size=CHUNK_SIZE):
+    """
+    Re-encode every legacy or older version listing, commute and transaction value with src.codec.
+    Safe to re-run, values already in the current encoding are left alone.
+    """
+    listing_keys = list(iter_listing_keys(redis))
+    routes = legacy_route if STORE_ROUTES else None
+    totals = {}
+    for keys in chunks(listing_keys, chunk_size):
+        poi_keys = [p.decode() for pois in smembers_chunked(redis, [poi_index_key(k) for k in keys]) for p in pois]
+        work = [
+            ("listings", keys, get_listing_field(redis, keys, ""), lambda v: encode_listing(decode_listing(v)), None),
+            ("commutes", [k + DOWNTOWN for k in keys], get_listing_field(redis, keys, DOWNTOWN),
+             lambda v: encode_commute(decode_commute(v)), routes),
+            ("commutes", poi_keys, mget_chunked(redis, poi_keys), lambda v: encode_commute(decode_commute(v)),
+             routes),
+        ]
+        for name, record_keys, values, convert, extra in work:
+            counts = _migrate_values(redis, record_keys, values, convert, dry_run, extra)
+            totals[name] = [a + b for a, b in zip(totals.get(name, [0, 0, 0]), counts)]
+
+    properties = [p.decode() for p in redis.smembers(HONESTDOOR_SET_KEY)]
+    for batch in chunks(properties, chunk_size):
+        keys = [HONESTDOOR_SET_KEY + "/" + p for p in batch]
+        counts = _migrate_values(redis, keys, mget_chunked(redis, keys),
+                                 lambda v: encode_transactions(decode_transactions(v)), dry_run)
+        totals["transactions"] = [a + b for a, b in zip(totals.get("transactions", [0, 0, 0]), counts)]
+
+    for name, (converted, before, after) in totals.items():
+        log.info(name + ": " + str(converted) + " values, " + str(before) + " -> " + str(after) + " bytes")
+    return totals
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    migrate(Redis(host=os.getenv("REDIS_HOST", "10.20.40.57")), dry_run="--dry-run" in sys.argv)
+
+
+if __name__ == "__main__":
+    main()
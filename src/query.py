@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+
+class ListingQueryEngine:
+    """
+    Read-only index over a listing snapshot for the dashboard filters. Price and transit time are kept as
+    sorted arrays so a range is two binary searches, type, bedrooms and bathrooms as one packed bitmap per
+    distinct value. query() ANDs the bitmaps of every constraint and returns the matching row positions, in
+    row order, so the same answer picks the points or bins update_map draws and the rows of the table.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.size = len(df)
+        self._ranges = {name: self._sorted(df[name]) for name in ['price', 'transit_time']}
+        self._values = {name: self._bitmaps(df[name]) for name in ['bedrooms', 'bathrooms']}
+        # categorical codes, -1 is a listing without a type
+        types = df['type'].astype('category')
+        codes = types.cat.codes.to_numpy()
+        self._types = {None if code < 0 else types.cat.categories[code]: np.packbits(codes == code)
+                       for code in np.unique(codes)}
+
+    @staticmethod
+    def _sorted(column):
+        # NaN sorts last, so a finite upper bound never matches a listing without a value
+        values = column.to_numpy(dtype=float)
+        order = np.argsort(values, kind='stable')
+        return values[order], order
+
+    def _bitmaps(self, column):
+        values = column.to_numpy(dtype=float)
+        distinct = np.unique(values[~np.isnan(values)])
+        return distinct, {v: np.packbits(values == v) for v in distinct}
+
+    def _empty(self):
+        return np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _full(self):
+        return np.packbits(np.ones(self.size, dtype=bool))
+
+    def _range_bitmap(self, name, low, high):
+        values, order = self._ranges[name]
+        start, stop = np.searchsorted(values, low, side='left'), np.searchsorted(values, high, side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[order[start:stop]] = True
+        return np.packbits(mask)
+
+    def _union(self, bitmaps):
+        result = self._empty()
+        for bitmap in bitmaps:
+            result |= bitmap
+        return result
+
+    def _value_bitmap(self, name, low, high):
+        distinct, bitmaps = self._values[name]
+        return self._union(bitmaps[v] for v in distinct[(distinct >= low) & (distinct <= high)])
+
+    def _type_bitmap(self, types):
+        keys = {None if pd.isna(t) else t for t in types}
+        return self._union(bitmap for t, bitmap in self._types.items() if t in keys)
+
+    def query(self, price=None, transit_time=None, bedrooms=None, bathrooms=None, types=None):
+        """Ranges are inclusive (low, high) tuples, types a collection of types; None leaves a field unfiltered."""
+        result = self._full()
+        for name, bounds in [('price', price), ('transit_time', transit_time)]:
+            if bounds is not None:
+                result &= self._range_bitmap(name, *bounds)
+        for name, bounds in [('bedrooms', bedrooms), ('bathrooms', bathrooms)]:
+            if bounds is not None:
+                result &= self._value_bitmap(name, *bounds)
+        if types is not None:
+            result &= self._type_bitmap(types)
+        return np.flatnonzero(np.unpackbits(result, count=self.size))
@@ -1,7 +1,7 @@
-import json
-
 from redis import Redis
 
+from bulk import LATITUDE, LISTING, LONGITUDE, get_listing_field, mset_pipelined
+from codec import decode_listing
 from location import Location, geocode_destination_here
 
 
@@ -14,6 +14,15 @@ def set_latitude_longitude_listing(location: Location, redis):
         return True
 
 
+def set_latitude_longitude_listings(locations, redis):
+    items = []
+    for location in locations:
+        if location.listing_key is not None:
+            items.append((location.listing_key + LATITUDE, location.latitude))
+            items.append((location.listing_key + LONGITUDE, location.longitude))
+    mset_pipelined(redis, items)
+
+
 def get_latitude_longitude_listing(location: Location, redis):
     if location.listing_key is None:
         return False
@@ -23,15 +32,32 @@ def get_latitude_longitude_listing(location: Location, redis):
         return lat, long
 
 
+def get_latitude_longitude_listings(listing_keys, redis):
+    # None for listings that have no stored coordinates yet
+    lats = get_listing_field(redis, listing_keys, LATITUDE)
+    longs = get_listing_field(redis, listing_keys, LONGITUDE)
+    return [None if lat is None or long is None else (float(lat), float(long)) for lat, long in zip(lats, longs)]
+
+
 def location_from_listing(listing: str, redis: Redis):
     value = redis.get(listing)
-    value = json.loads((value))
-    l = Location(geocode_destination_here(value['address']))
-    l.listing_key = listing
+    value = decode_listing(value)
+    if value.get('lat') is not None and value.get('long') is not None:
+        # mls-polling already stores the coordinates realtor.ca gives us
+        l = Location(latitude=float(value['lat']), longitude=float(value['long']), listing_key=listing)
+        l.address = value['address']
+    else:
+        l = Location(geocode_destination_here(value['address']))
+        l.listing_key = listing
+    set_latitude_longitude_listing(l, redis)
     return l
 
 
 def listing_from_location(location: Location, redis: Redis):
     # not all locations are a listing
-    return json.loads(redis.get(location.listing_key))
+    return decode_listing(redis.get(location.listing_key))
+
 
+def listings_from_keys(listing_keys, redis: Redis):
+    values = get_listing_field(redis, listing_keys, LISTING)
+    return [None if value is None else decode_listing(value) for value in values]
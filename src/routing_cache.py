@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+from collections import Counter
+
+from redis import Redis
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+CACHE_PREFIX = "house-search:routing/"
+STATS_KEY = "house-search:routing_stats"
+
+# 4 decimal places is a cell of roughly 11m x 7m at Calgary's latitude, listings in the same
+# building or a few doors apart share a route
+GRID_PRECISION = int(os.getenv("ROUTING_GRID_PRECISION", 4))
+
+DAY = 24 * 60 * 60
+# transit schedules change every few months and car routes pick up construction,
+# walking and cycling routes barely move
+MODE_TTLS = {
+    'transit': 7 * DAY,
+    'car': 14 * DAY,
+    'bicycle': 90 * DAY,
+    'pedestrian': 90 * DAY,
+}
+
+
+def grid_cell(latitude, longitude, precision=GRID_PRECISION):
+    return f"{round(float(latitude), precision)},{round(float(longitude), precision)}"
+
+
+def cache_key(mode, origin, destination, precision=GRID_PRECISION):
+    # origin and destination are (latitude, longitude) pairs
+    return CACHE_PREFIX + mode + "/" + grid_cell(*origin, precision) + "/" + grid_cell(*destination, precision)
+
+
+def is_cacheable(response):
+    # never cache errors or "routing is not possible" notices
+    return isinstance(response, dict) and len(response.get('routes', [])) > 0
+
+
+class RoutingCache:
+
+    def __init__(self, redis: Redis, ttls=None, precision=GRID_PRECISION):
+        self.redis = redis
+        self.ttls = dict(MODE_TTLS if ttls is None else ttls)
+        self.precision = precision
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def key(self, mode, origin, destination):
+        return cache_key(mode, origin, destination, self.precision)
+
+    def get(self, mode, origin, destination):
+        value = self.redis.get(self.key(mode, origin, destination))
+        if value is None:
+            self.misses[mode] += 1
+            return None
+        self.hits[mode] += 1
+        return json.loads(value)
+
+    def set(self, mode, origin, destination, response):
+        if is_cacheable(response):
+            self.redis.set(self.key(mode, origin, destination), json.dumps(response), ex=self.ttls.get(mode))
+
+    def get_many(self, requests):
+        # requests are (mode, origin, destination), one pipelined round trip, responses by key with None
+        # for a miss; not counted, the caller records what it ends up serving from them
+        keys = [self.key(*request) for request in requests]
+        pipe = self.redis.pipeline(transaction=False)
+        for k in keys:
+            pipe.get(k)
+        return {k: None if value is None else json.loads(value) for k, value in zip(keys, pipe.execute())}
+
+    def set_many(self, items):
+        # items are (mode, origin, destination, response)
+        pipe = self.redis.pipeline(transaction=False)
+        for mode, origin, destination, response in items:
+            if is_cacheable(response):
+                pipe.set(self.key(mode, origin, destination), json.dumps(response), ex=self.ttls.get(mode))
+        pipe.execute()
+
+    def record(self, mode, hit):
+        (self.hits if hit else self.misses)[mode] += 1
+
+    def fetch(self, mode, origin, destination, request):
+        # request is called with no arguments and returns the HERE response on a miss
+        response = self.get(mode, origin, destination)
+        if response is None:
+            response = request()
+            self.set(mode, origin, destination, response)
+        return response
+
+    def hit_rate(self):
+        total = sum(self.hits.values()) + sum(self.misses.values())
+        return sum(self.hits.values()) / total if total else 0.0
+
+    def flush_stats(self):
+        # fold the in-process counters into the shared stats hash and reset them
+        pipe = self.redis.pipeline(transaction=False)
+        for mode, count in self.hits.items():
+            pipe.hincrby(STATS_KEY, mode + ":hits", count)
+        for mode, count in self.misses.items():
+            pipe.hincrby(STATS_KEY, mode + ":misses", count)
+        pipe.execute()
+        log.info("Routing cache hit rate " + str(round(self.hit_rate(), 3)) + " hits=" + str(dict(self.hits))
+                 + " misses=" + str(dict(self.misses)))
+        self.hits.clear()
+        self.misses.clear()
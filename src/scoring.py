@@ -1,14 +1,19 @@
-import ast
-import json
 import logging
 import os
+import sys
 import traceback
 
+import numpy as np
 import redis
 from redis import Redis
 
 from src import location
 from src.location import geocode_destination_here, Location
+from src.bulk import CHUNK_SIZE, CUSTOM_COMMUTE_SCORE, DOWNTOWN, DOWNTOWN_COMMUTE_SCORE, LISTING, TOTAL_SCORE, \
+    get_listing_field, mget_chunked, set_listing_field, smembers_chunked
+from src.changes import COMMUTE_CHANGES_STREAM, follow
+from src.codec import decode_commute, decode_listing
+from src.listing_index import iter_listing_keys, iter_poi_keys, poi_index_key
 from src.redis_locations import location_from_listing, set_latitude_longitude_listing
 
 log = logging.getLogger(__name__)
@@ -76,60 +81,61 @@ def calculate_transit_score(time, route):
         return 10 - ((time - transit_perfect) * transit_slope)
 
 
-def add_custom_commute_score_to_all(walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1):
-    listings = redis.keys('house-search:listings/*')
-    if walk_weight < 0:
-        walk_weight = 1
-        log.info("Reset negative walk weight to 1")
+def _piecewise_scores(times, perfect, maximum, slope):
+    # vectorized twin of the calculate_*_score functions above, keep the arithmetic identical
+    return np.where(times <= perfect, 10.0,
+                    np.where(times >= maximum, 0.0, 10 - ((times - perfect) * slope)))
 
-    if bike_weight < 0:
-        bike_weight = 1
-        log.info("Reset negative bike weight to 1")
 
-    if transit_weight < 0:
-        transit_weight = 1
-        log.info("Reset negative transit weight to 1")
+def calculate_walk_scores(times):
+    return _piecewise_scores(np.asarray(times, dtype=float), walk_perfect, walk_max, walk_slope)
 
-    if drive_weight < 0:
-        drive_weight = 1
-        log.info("Reset negative drive weight to 1")
 
-    weighted_sum = walk_weight + bike_weight + transit_weight + drive_weight
-    if weighted_sum <= 0:
-        # Someone entered weird values
-        log.info("Resetting weights due to weighted_sum being <=0")
-        weighted_sum = 4
-        walk_weight = bike_weight = transit_weight = drive_weight = 1
+def calculate_bike_scores(times):
+    return _piecewise_scores(np.asarray(times, dtype=float), bike_perfect, bike_max, bike_slope)
 
-    for i in listings:
-        k = i.decode()
-        if "latitude" in k or "longitude" in k or "/downtown" in k or "/poi/" in k or "score" in k:
-            pass
-            # these keys do not represent a listing
-        else:
-            try:
-                walk_score = bike_score = transit_score = drive_score = 0
-                pois = redis.keys(k + '/poi/*')
-                if len(pois) > 0:
-                    for place in pois:
-                        str_place = place.decode()
-                        data = ast.literal_eval(redis.get(str_place).decode())
-                        walk_score = walk_score + calculate_walk_score(data['walk_time'])
-                        bike_score = bike_score + calculate_bike_score(data['bike_time'])
-                        drive_score = drive_score + calculate_drive_score(data['drive_time'])
-                        transit_score = transit_score + calculate_transit_score(data['transit_time'],
-
-                                                                                data['transit_route']['routes'][0])
-                    score = (
-                                    walk_score * walk_weight + bike_score * bike_weight + transit_score * transit_weight + drive_score * drive_weight) / (
-                                    weighted_sum * len(pois))
-                    redis.set(k + "/custom_commute_score", score)
-            except Exception as e:
-                log.exception(traceback.format_exc())
-
-
-def add_downtown_commute_score_to_all(walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1):
-    listings = redis.keys('house-search:listings/*')
+
+def calculate_drive_scores(times):
+    return _piecewise_scores(np.asarray(times, dtype=float), drive_perfect, drive_max, drive_slope)
+
+
+def calculate_transit_scores(times, sections):
+    times = np.asarray(times, dtype=float)
+    sections = np.asarray(sections)
+    base = 10 - ((times - transit_perfect) * transit_slope)
+    # same short route bonus as calculate_transit_score
+    middle = np.where(sections < 3, np.minimum(10, base + 1), base)
+    return np.where(times <= transit_perfect, 10.0, np.where(times >= transit_max, 0.0, middle))
+
+
+def commute_row(data):
+    # data is a codec.decode_commute record, the only parts of a commute the scores depend on
+    return (data['walk_time'], data['bike_time'], data['drive_time'], data['transit_time'],
+            data['transit_sections'])
+
+
+def score_commute_batch(rows, owners, n_owners, walk_weight, bike_weight, transit_weight, drive_weight,
+                        weighted_sum):
+    """
+    Score many commute records at once. rows are commute_row tuples, owners maps each row to the
+    index of the listing it belongs to. Returns one averaged, weighted score per listing.
+    """
+    if n_owners == 0:
+        return np.zeros(0)
+    table = np.array(rows, dtype=float).reshape(-1, 5)
+    owners = np.asarray(owners, dtype=np.intp)
+    # bincount adds rows in order, so per listing sums match the scalar loops exactly
+    walk_score = np.bincount(owners, weights=calculate_walk_scores(table[:, 0]), minlength=n_owners)
+    bike_score = np.bincount(owners, weights=calculate_bike_scores(table[:, 1]), minlength=n_owners)
+    drive_score = np.bincount(owners, weights=calculate_drive_scores(table[:, 2]), minlength=n_owners)
+    transit_score = np.bincount(owners, weights=calculate_transit_scores(table[:, 3], table[:, 4]),
+                                minlength=n_owners)
+    counts = np.bincount(owners, minlength=n_owners)
+    return (walk_score * walk_weight + bike_score * bike_weight + transit_score * transit_weight
+            + drive_score * drive_weight) / (weighted_sum * counts)
+
+
+def _commute_weights(walk_weight, bike_weight, transit_weight, drive_weight):
     if walk_weight < 0:
         walk_weight = 1
         log.info("Reset negative walk weight to 1")
@@ -152,31 +158,72 @@ def add_downtown_commute_score_to_all(walk_weight=1, bike_weight=1, transit_weig
         log.info("Resetting weights due to weighted_sum being <=0")
         weighted_sum = 4
         walk_weight = bike_weight = transit_weight = drive_weight = 1
+    return walk_weight, bike_weight, transit_weight, drive_weight, weighted_sum
 
-    for i in listings:
-        k = i.decode()
-        if "latitude" in k or "longitude" in k or "/downtown" in k or "/poi/" in k or "score" in k:
-            pass
-            # these keys do not represent a listing
-        else:
-            try:
-                walk_score = bike_score = transit_score = drive_score = 0
-                data = ast.literal_eval(redis.get(k + '/downtown').decode())
-                walk_score = walk_score + calculate_walk_score(data['walk_time'])
-                bike_score = bike_score + calculate_bike_score(data['bike_time'])
-                drive_score = drive_score + calculate_drive_score(data['drive_time'])
-                transit_score = transit_score + calculate_transit_score(data['transit_time'],
-                                                                        data['transit_route']['routes'][0])
-                score = (
-                                walk_score * walk_weight + bike_score * bike_weight + transit_score * transit_weight + drive_score * drive_weight) / (
-                            weighted_sum)
-                redis.set(k + "/downtown_commute_score", score)
-            except Exception as e:
-                log.exception(traceback.format_exc())
+
+def add_custom_commute_score_to_all(walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1,
+                                    chunk_size=CHUNK_SIZE):
+    add_custom_commute_score_to_listings(list(iter_listing_keys(redis)), walk_weight, bike_weight, transit_weight,
+                                         drive_weight, chunk_size)
+
+
+def add_custom_commute_score_to_listings(listing_keys, walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1,
+                                         chunk_size=CHUNK_SIZE):
+    walk_weight, bike_weight, transit_weight, drive_weight, weighted_sum = _commute_weights(
+        walk_weight, bike_weight, transit_weight, drive_weight)
+
+    poi_sets = smembers_chunked(redis, [poi_index_key(k) for k in listing_keys], chunk_size)
+    # sorted so the per listing sums always add pois in the same order as add_custom_commute_score_to_one
+    listing_pois = [(k, sorted(p.decode() for p in pois)) for k, pois in zip(listing_keys, poi_sets) if len(pois) > 0]
+
+    values = mget_chunked(redis, [p for _, pois in listing_pois for p in pois], chunk_size)
+    scored_keys, rows, owners = [], [], []
+    position = 0
+    for k, pois in listing_pois:
+        raw = values[position:position + len(pois)]
+        position += len(pois)
+        try:
+            listing_rows = [commute_row(decode_commute(v)) for v in raw]
+        except Exception as e:
+            log.exception(traceback.format_exc())
+            continue
+        owners.extend([len(scored_keys)] * len(listing_rows))
+        rows.extend(listing_rows)
+        scored_keys.append(k)
+
+    scores = score_commute_batch(rows, owners, len(scored_keys), walk_weight, bike_weight, transit_weight,
+                                 drive_weight, weighted_sum)
+    # tolist() hands redis plain floats rather than numpy scalars
+    set_listing_field(redis, scored_keys, CUSTOM_COMMUTE_SCORE, scores.tolist(), chunk_size)
+
+
+def add_downtown_commute_score_to_all(walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1,
+                                      chunk_size=CHUNK_SIZE):
+    add_downtown_commute_score_to_listings(list(iter_listing_keys(redis)), walk_weight, bike_weight, transit_weight,
+                                           drive_weight, chunk_size)
+
+
+def add_downtown_commute_score_to_listings(listing_keys, walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1,
+                                           chunk_size=CHUNK_SIZE):
+    walk_weight, bike_weight, transit_weight, drive_weight, weighted_sum = _commute_weights(
+        walk_weight, bike_weight, transit_weight, drive_weight)
+
+    values = get_listing_field(redis, listing_keys, DOWNTOWN, chunk_size)
+    scored_keys, rows = [], []
+    for k, v in zip(listing_keys, values):
+        try:
+            rows.append(commute_row(decode_commute(v)))
+        except Exception as e:
+            log.exception(traceback.format_exc())
+            continue
+        scored_keys.append(k)
+
+    scores = score_commute_batch(rows, range(len(rows)), len(scored_keys), walk_weight, bike_weight,
+                                 transit_weight, drive_weight, weighted_sum)
+    set_listing_field(redis, scored_keys, DOWNTOWN_COMMUTE_SCORE, scores.tolist(), chunk_size)
 
 
 def add_custom_commute_score_to_one(location, walk_weight=1, bike_weight=1, transit_weight=1, drive_weight=1):
-    listings = redis.keys('house-search:listings/*')
     if walk_weight < 0:
         walk_weight = 1
         log.info("Reset negative walk weight to 1")
@@ -200,22 +247,13 @@ def add_custom_commute_score_to_one(location, walk_weight=1, bike_weight=1, tran
         weighted_sum = 4
         walk_weight = bike_weight = transit_weight = drive_weight = 1
 
-    pois = redis.keys(location.listing_key + '/poi/*')
+    pois = sorted(iter_poi_keys(redis, location.listing_key))
     if len(pois) > 0:
         try:
-            walk_score = bike_score = transit_score = drive_score = 0
-            for place in pois:
-                str_place = place.decode()
-                data = ast.literal_eval(redis.get(str_place).decode())
-                walk_score = walk_score + calculate_walk_score(data['walk_time'])
-                bike_score = bike_score + calculate_bike_score(data['bike_time'])
-                drive_score = drive_score + calculate_drive_score(data['drive_time'])
-                transit_score = transit_score + calculate_transit_score(data['transit_time'],
-                                                                        data['transit_route']['routes'][0])
-            score = (
-                            walk_score * walk_weight + bike_score * bike_weight + transit_score * transit_weight + drive_score * drive_weight) / (
-                            weighted_sum * len(pois))
-            redis.set(location.listing_key + "/custom_commute_score", score)
+            rows = [commute_row(decode_commute(value)) for value in mget_chunked(redis, pois)]
+            score = score_commute_batch(rows, [0] * len(rows), 1, walk_weight, bike_weight, transit_weight,
+                                        drive_weight, weighted_sum)[0]
+            redis.set(location.listing_key + "/custom_commute_score", float(score))
         except Exception as e:
             log.exception(traceback.format_exc())
 
@@ -245,24 +283,16 @@ def add_downtown_commute_score_to_one(location, walk_weight=1, bike_weight=1, tr
         walk_weight = bike_weight = transit_weight = drive_weight = 1
 
     try:
-        walk_score = bike_score = transit_score = drive_score = 0
-        data = ast.literal_eval(redis.get(location.listing_key + "/downtown").decode())
-        walk_score = walk_score + calculate_walk_score(data['walk_time'])
-        bike_score = bike_score + calculate_bike_score(data['bike_time'])
-        drive_score = drive_score + calculate_drive_score(data['drive_time'])
-        transit_score = transit_score + calculate_transit_score(data['transit_time'],
-                                                                data['transit_route']['routes'][0])
-        score = (
-                        walk_score * walk_weight + bike_score * bike_weight + transit_score * transit_weight + drive_score * drive_weight) / (
-                    weighted_sum)
-        redis.set(location.listing_key + "/downtown_commute_score", score)
+        rows = [commute_row(decode_commute(redis.get(location.listing_key + "/downtown")))]
+        score = score_commute_batch(rows, [0], 1, walk_weight, bike_weight, transit_weight, drive_weight,
+                                    weighted_sum)[0]
+        redis.set(location.listing_key + "/downtown_commute_score", float(score))
     except Exception as e:
         log.exception(traceback.format_exc())
 
 
 def add_total_score_to_all(max_price=10000000.0, min_price=0, min_lot_size=0, price_weight=1, transit_weight=1,
-                           size_weight=1):
-    listings = redis.keys('house-search:listings/*')
+                           size_weight=1, chunk_size=CHUNK_SIZE):
     if transit_weight < 0:
         walk_weight = 1
         log.info("Reset negative walk weight to 1")
@@ -282,42 +312,42 @@ def add_total_score_to_all(max_price=10000000.0, min_price=0, min_lot_size=0, pr
         weighted_sum = 3
         price_weight = transit_weight = size_weight = 1
 
-    for i in listings:
-        k = i.decode()
-        if "latitude" in k or "longitude" in k or "/downtown" in k or "/poi/" in k or "score" in k:
-            pass
-            # these keys do not represent a listing
-        else:
-            try:
-                transit_score = redis.get(k + "/downtown_commute_score")
-                if transit_score is None:
-                    transit_score = 0
-
-                listing = json.loads(redis.get(k))
-                price = listing['price']
-                if price > max_price or price < min_price:
-                    price_score = 0
-                else:
-                    price_score = 10
-
-                if 'lot_size' in listing:
-                    size = listing['lot_size']
-                    try:
-                        size = [int(s) for s in size.split() if s.isdigit()][-1]
-                        if size > min_lot_size:
-                            size_score = 10
-                    except:
-                        log.warning('lot size not parsed for ' + k)
-                        size_score = 0
-                else:
+    listing_keys = list(iter_listing_keys(redis))
+    transit_scores = get_listing_field(redis, listing_keys, DOWNTOWN_COMMUTE_SCORE, chunk_size)
+    listings = get_listing_field(redis, listing_keys, LISTING, chunk_size)
+    scored_keys, scores = [], []
+    for k, transit_score, listing in zip(listing_keys, transit_scores, listings):
+        try:
+            if transit_score is None:
+                transit_score = 0
+
+            listing = decode_listing(listing)
+            price = listing['price']
+            if price > max_price or price < min_price:
+                price_score = 0
+            else:
+                price_score = 10
+
+            if 'lot_size' in listing:
+                size = listing['lot_size']
+                try:
+                    size = [int(s) for s in size.split() if s.isdigit()][-1]
+                    if size > min_lot_size:
+                        size_score = 10
+                except:
+                    log.warning('lot size not parsed for ' + k)
                     size_score = 0
-                score = (
-                                price_score * price_weight + size_score * size_weight + float(
-                            transit_score) * transit_weight) / (
-                            weighted_sum)
-                redis.set(k + "/total_score", score)
-            except Exception as e:
-                log.exception(traceback.format_exc())
+            else:
+                size_score = 0
+            score = (
+                            price_score * price_weight + size_score * size_weight + float(
+                        transit_score) * transit_weight) / (
+                        weighted_sum)
+            scored_keys.append(k)
+            scores.append(score)
+        except Exception as e:
+            log.exception(traceback.format_exc())
+    set_listing_field(redis, scored_keys, TOTAL_SCORE, scores, chunk_size)
 
 def add_total_score_to_one(location, max_price=10000000.0, min_price=0, min_lot_size=0, price_weight=1, transit_weight=1,
                            size_weight=1):
@@ -345,7 +375,7 @@ def add_total_score_to_one(location, max_price=10000000.0, min_price=0, min_lot_
         if transit_score is None:
             transit_score = 0
 
-        listing = json.loads(redis.get(location.listing_key))
+        listing = decode_listing(redis.get(location.listing_key))
         price = listing['price']
         if price > max_price or price < min_price:
             price_score = 0
@@ -373,7 +403,17 @@ def add_total_score_to_one(location, max_price=10000000.0, min_price=0, min_lot_
         log.exception(traceback.format_exc())
 
 
-def main():
+def handle_commute_changes(changes):
+    listing_keys = list(changes)
+    add_custom_commute_score_to_listings(listing_keys)
+    add_downtown_commute_score_to_listings(listing_keys)
+    log.info("Rescored " + str(len(listing_keys)) + " listings with new commute data")
+
+
+def main(follow_changes=False):
+    if follow_changes:
+        # only rescore listings the downtown worker has just rerouted
+        follow(redis, COMMUTE_CHANGES_STREAM, "scoring", handle_commute_changes)
     # default behaviour is to add to all
     add_custom_commute_score_to_all()
     add_downtown_commute_score_to_all()
@@ -382,4 +422,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    main(follow_changes="--follow" in sys.argv)
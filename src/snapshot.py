@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger as log
+from redis import Redis
+
+from bulk import CUSTOM_COMMUTE_SCORE, DOWNTOWN, DOWNTOWN_COMMUTE_SCORE, TOTAL_SCORE, get_listing_field, mget_chunked
+from codec import decode_commute_field, decode_listing, decode_transactions
+from listing_index import HONESTDOOR_SET_KEY, listing_key
+
+# the dashboard reads this file once at startup instead of walking redis
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data",
+                                                        "listings.parquet"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", 3600))
+HONESTDOOR_COLS = ['DateSold', 'PriceLastSold', 'property_id', 'Assessment Price']
+SCORE_SUFFIXES = {'downtown_commute_score': DOWNTOWN_COMMUTE_SCORE, 'custom_commute_score': CUSTOM_COMMUTE_SCORE,
+                  'total_score': TOTAL_SCORE}
+# web mercator (EPSG:3857) sphere, same as holoviews' lon_lat_to_easting_northing
+ORIGIN_SHIFT = np.pi * 6378137
+
+
+def add_web_mercator(df):
+    # projected once for the whole frame so map redraws only read the easting/northing columns
+    long = df['long'].to_numpy(dtype=float)
+    lat = df['lat'].to_numpy(dtype=float)
+    df['easting'] = long * ORIGIN_SHIFT / 180.0
+    df['northing'] = np.log(np.tan((90 + lat) * np.pi / 360.0)) * ORIGIN_SHIFT / np.pi
+    return df
+
+
+def _last_sale(value):
+    transactions = decode_transactions(value)
+    if transactions.empty:
+        return dict.fromkeys(HONESTDOOR_COLS)
+    return dict(zip(HONESTDOOR_COLS, transactions.iloc[0].tolist()))
+
+
+def build_snapshot(redis: Redis):
+    """
+    Join every listing that has HonestDoor transactions with its last sale, downtown transit time and scores
+    into one DataFrame indexed by url key, with web mercator coordinates for the map. Everything is read with
+    chunked MGETs, one row per listing.
+    """
+    url_keys = sorted(a.decode() for a in redis.smembers(HONESTDOOR_SET_KEY))
+    keys = [listing_key(a) for a in url_keys]
+    listings = get_listing_field(redis, keys, "")
+    honestdoor = mget_chunked(redis, [HONESTDOOR_SET_KEY + "/" + a for a in url_keys])
+    commutes = get_listing_field(redis, keys, DOWNTOWN)
+    scores = {name: get_listing_field(redis, keys, suffix) for name, suffix in SCORE_SUFFIXES.items()}
+
+    rows, index = [], []
+    for i, (a, listing, hd) in enumerate(zip(url_keys, listings, honestdoor)):
+        if listing is None or hd is None:
+            continue
+        row = decode_listing(listing)
+        row.update(_last_sale(hd))
+        row['transit_time'] = decode_commute_field(commutes[i], 'transit_time') if commutes[i] is not None else None
+        for name, values in scores.items():
+            row[name] = values[i]
+        rows.append(row)
+        index.append(a)
+
+    df = pd.DataFrame(rows, index=index)
+    for name in ['transit_time', *SCORE_SUFFIXES]:
+        df[name] = pd.to_numeric(df[name], errors='coerce')
+    df['photo'] = df.pop('photo_url')
+    df['DateSold'] = pd.to_datetime(df['DateSold']).dt.date
+    df['address'] = df['address'].str.split('|').str[0]
+    return add_web_mercator(df)
+
+
+def write_snapshot(df, path=SNAPSHOT_PATH):
+    # write next to the target and rename, so a reader never sees a half written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    df = pd.read_parquet(path, memory_map=True)
+    if 'northing' not in df.columns:
+        # written before the projection was part of the snapshot
+        add_web_mercator(df)
+    return df
+
+
+def refresh_snapshot(redis: Redis, path=SNAPSHOT_PATH):
+    start = time.monotonic()
+    df = build_snapshot(redis)
+    write_snapshot(df, path)
+    log.info(f"Wrote {len(df)} listings to {path} in {time.monotonic() - start:.1f}s")
+    return df
+
+
+def main(loop=False):
+    redis = Redis(host=os.getenv("REDIS_HOST", "10.30.40.132"))
+    while True:
+        refresh_snapshot(redis)
+        if not loop:
+            break
+        time.sleep(SNAPSHOT_INTERVAL)
+
+
+if __name__ == "__main__":
+    main(loop="--loop" in sys.argv)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# the dashboard modules import their siblings bare, the way panel serve runs them from src/
+sys.path.insert(1, os.path.join(ROOT, "src"))
+# src.location reads the key at import, the tests only ever talk to local stub servers
+os.environ.setdefault("HERE_API_KEY", "test")
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import fakeredis
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.async_routing import AsyncRoutingClient, MODES
+from src.location import Location
+from src.routing_cache import RoutingCache
+
+DESTINATION = Location(latitude=51.0478, longitude=-114.0592)
+FAILING_LATITUDE = 50.9
+
+
+def here_route(minutes):
+    return {'routes': [{'sections': [{'departure': {'time': '2021-05-03T08:00:00-06:00'},
+                                      'arrival': {'time': f'2021-05-03T08:{minutes:02d}:00-06:00'}}]}]}
+
+
+class StubHere:
+    """Local stand-in for the HERE transit and router APIs that records what it was asked."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def handle(self, request):
+        mode = request.query.get('transportMode', 'transit')
+        self.calls.append((mode, request.query['origin'], time.monotonic()))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        if request.query['origin'].startswith(str(FAILING_LATITUDE)):
+            return web.json_response({'error': 'boom'}, status=500)
+        return web.json_response(here_route(MODES.index(mode) + 10))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/transit', self.handle)
+        app.router.add_get('/router', self.handle)
+        return app
+
+
+def run_commutes(stub, pairs, **kwargs):
+    async def go():
+        async with TestServer(stub.app()) as server:
+            async with AsyncRoutingClient('test', transit_url=str(server.make_url('/transit')),
+                                          router_url=str(server.make_url('/router')), **kwargs) as client:
+                start = time.monotonic()
+                results = await client.commutes(pairs)
+                return results, time.monotonic() - start
+    return asyncio.run(go())
+
+
+def origins(n, step=0.01):
+    return [Location(latitude=51.0 + i * step, longitude=-114.1) for i in range(n)]
+
+
+def test_four_modes_run_concurrently():
+    stub = StubHere(delay=0.2)
+    (commute,), elapsed = run_commutes(stub, [(origins(1)[0], DESTINATION)])
+    assert sorted(mode for mode, _, _ in stub.calls) == sorted(MODES)
+    assert stub.max_in_flight == 4
+    assert elapsed < 0.6
+    assert (commute['transit_time'], commute['walk_time'], commute['drive_time'], commute['bike_time']) == \
+           (10, 11, 12, 13)
+
+
+def test_concurrency_limit_holds():
+    stub = StubHere()
+    results, _ = run_commutes(stub, [(o, DESTINATION) for o in origins(5)], concurrency=3)
+    assert len(stub.calls) == 20
+    assert stub.max_in_flight <= 3
+    assert not any(isinstance(r, Exception) for r in results)
+
+
+def test_rate_limit_holds():
+    stub = StubHere(delay=0)
+    _, elapsed = run_commutes(stub, [(o, DESTINATION) for o in origins(8)], rate_limit=20)
+    # a burst of 20, then the other 12 of the 32 requests at 20 per second. Timed from the client opening, when
+    # the bucket starts filling, not from the first request, which the cache lookups hold back a little
+    assert len(stub.calls) == 32
+    assert elapsed >= 12 / 20 - 0.05
+
+
+def test_errors_come_back_per_pair():
+    stub = StubHere()
+    pairs = [(o, DESTINATION) for o in origins(3)]
+    pairs.insert(1, (Location(latitude=FAILING_LATITUDE, longitude=-114.1), DESTINATION))
+    results, _ = run_commutes(stub, pairs)
+    assert isinstance(results[1], Exception)
+    assert [isinstance(r, dict) for r in results] == [True, False, True, True]
+
+
+def test_cache_hits_skip_http():
+    cache = RoutingCache(fakeredis.FakeRedis())
+    # ten listings in the same grid cell, routed in one batch
+    same_cell = [Location(latitude=51.00001 + i * 1e-6, longitude=-114.1) for i in range(10)]
+    stub = StubHere()
+    results, _ = run_commutes(stub, [(o, DESTINATION) for o in same_cell], cache=cache)
+    assert len(stub.calls) == 4
+    assert len(results) == 10 and all(r['transit_time'] == 10 for r in results)
+    assert sum(cache.misses.values()) == 4 and sum(cache.hits.values()) == 36
+
+    stub = StubHere()
+    results, _ = run_commutes(stub, [(o, DESTINATION) for o in same_cell[:3]], cache=cache)
+    assert stub.calls == []
+    assert all(r['walk_time'] == 11 for r in results)
@@ -0,0 +1,120 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from src.codec import COMMUTE, COMMUTE_FIELDS, COMMUTE_STRUCT, HEADER_SIZE, LISTING, LISTING_FIELDS, MAGIC, \
+    CodecError, _pack, commute_field_range, decode_commute, decode_commute_field, decode_listing, decode_route, \
+    decode_transactions, encode_commute, encode_listing, encode_route, encode_transactions, is_encoded
+
+LISTING_RECORD = {'address': '123 Fake St NW', 'lat': 51.0447, 'long': -114.0719,
+                  'detail_url': 'https://example.com/listing/123', 'price': 525000.0, 'id': '123',
+                  'mls_number': 'A1234567', 'key': 'house-search:listings/123', 'bathrooms': 2.5, 'bedrooms': 3,
+                  'size': 1650.0, 'type': 'House', 'stories': 2.0, 'lot_size': None, 'photo_url': None}
+ROUTE = {'routes': [{'sections': [{'type': 'pedestrian'}, {'type': 'transit'}, {'type': 'pedestrian'}]}]}
+COMMUTE_RECORD = {'transit_time': 25, 'walk_time': 95, 'drive_time': 12, 'bike_time': 30, 'transit_sections': 3}
+LEGACY_COMMUTE = {'transit_route': ROUTE, 'transit_time': 25, 'walk_time': 95, 'drive_time': 12, 'bike_time': 30}
+
+
+def test_listing_round_trip():
+    value = encode_listing(LISTING_RECORD)
+    assert is_encoded(value)
+    assert value[:HEADER_SIZE] == MAGIC + bytes([LISTING, max(LISTING_FIELDS)])
+    assert decode_listing(value) == LISTING_RECORD
+
+
+def test_listing_fields_missing_from_the_source_decode_as_none():
+    assert decode_listing(encode_listing({'id': '7', 'price': 1.0})) == dict.fromkeys(LISTING_FIELDS[1]) | {
+        'id': '7', 'price': 1.0}
+
+
+def test_legacy_json_listing_still_decodes():
+    legacy = json.dumps(LISTING_RECORD)
+    assert not is_encoded(legacy.encode())
+    assert decode_listing(legacy) == LISTING_RECORD
+    assert decode_listing(legacy.encode()) == LISTING_RECORD
+
+
+def test_wrong_record_type_is_refused():
+    with pytest.raises(CodecError):
+        decode_listing(encode_commute(COMMUTE_RECORD))
+    with pytest.raises(CodecError):
+        decode_commute(encode_listing(LISTING_RECORD))
+
+
+def test_commute_struct_round_trip():
+    value = encode_commute(COMMUTE_RECORD)
+    assert value[:HEADER_SIZE] == MAGIC + bytes([COMMUTE, 2])
+    # fixed width, no msgpack framing
+    assert len(value) == HEADER_SIZE + COMMUTE_STRUCT[2].size == HEADER_SIZE + 10
+    assert COMMUTE_STRUCT[2].unpack_from(value, HEADER_SIZE) == (25, 95, 12, 30, 3)
+    assert decode_commute(value) == COMMUTE_RECORD
+
+
+def test_commute_struct_holds_the_full_unsigned_short_range():
+    record = dict.fromkeys(COMMUTE_FIELDS[2], 65535) | {'transit_time': 0}
+    assert decode_commute(encode_commute(record)) == record
+
+
+def test_full_commute_is_reduced_to_the_score_fields():
+    assert decode_commute(encode_commute(LEGACY_COMMUTE)) == COMMUTE_RECORD
+
+
+def test_decode_commute_field():
+    value = encode_commute(COMMUTE_RECORD)
+    for field, expected in COMMUTE_RECORD.items():
+        start, end = commute_field_range(field)
+        assert end - start == 1
+        assert decode_commute_field(value, field) == expected
+        # what GETRANGE would hand back
+        assert int.from_bytes(value[start:end + 1], 'little') == expected
+
+
+def test_decode_commute_field_falls_back_for_older_values():
+    v1 = _pack(COMMUTE, 1, [25, 95, 12, 30, 3])
+    legacy = str(LEGACY_COMMUTE).encode()
+    for value in (v1, legacy):
+        assert decode_commute(value) == COMMUTE_RECORD
+        assert decode_commute_field(value, 'walk_time') == 95
+        assert decode_commute_field(value, 'transit_sections') == 3
+
+
+def test_legacy_str_commute_still_decodes():
+    assert decode_commute(str(LEGACY_COMMUTE)) == COMMUTE_RECORD
+    assert decode_commute(str(LEGACY_COMMUTE).encode()) == COMMUTE_RECORD
+
+
+def test_unknown_commute_version_is_refused():
+    with pytest.raises(CodecError):
+        decode_commute(MAGIC + bytes([COMMUTE, 99]) + b'\x00' * 10)
+
+
+def test_route_round_trip():
+    assert decode_route(encode_route(ROUTE)) == ROUTE
+    with pytest.raises(CodecError):
+        decode_route(str(ROUTE).encode())
+
+
+def transactions():
+    return pd.DataFrame({'date': ['2019-04-01', '2021-06-15'], 'price': [410000, 455000.5],
+                         'event': ['sold', None]})
+
+
+def test_transactions_round_trip():
+    df = transactions()
+    pd.testing.assert_frame_equal(decode_transactions(encode_transactions(df)), df)
+
+
+def test_transactions_with_timestamps_are_stored_as_iso_strings():
+    df = transactions().assign(date=lambda d: pd.to_datetime(d['date']))
+    decoded = decode_transactions(encode_transactions(df))
+    assert decoded['date'].tolist() == ['2019-04-01T00:00:00', '2021-06-15T00:00:00']
+
+
+def test_legacy_to_json_transactions_still_decode():
+    df = transactions()
+    legacy = df.to_json()
+    pd.testing.assert_frame_equal(decode_transactions(legacy), pd.read_json(io.StringIO(legacy)))
+    pd.testing.assert_frame_equal(decode_transactions(legacy.encode()), decode_transactions(legacy))
+    assert decode_transactions(legacy)['price'].tolist() == [410000, 455000.5]
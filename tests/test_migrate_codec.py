@@ -0,0 +1,43 @@
+import fakeredis
+
+from src import migrate_codec
+from src.codec import COMMUTE, _pack, decode_commute, decode_route, encode_commute
+from src.listing_index import route_key
+
+ROUTE = {'routes': [{'sections': [{'departure': {'time': '2021-05-03T08:00:00-06:00'},
+                                   'arrival': {'time': '2021-05-03T08:25:00-06:00'}}] * 3}]}
+LEGACY = {'transit_route': ROUTE, 'transit_time': 25, 'walk_time': 95, 'drive_time': 12, 'bike_time': 30}
+DOWNTOWN_KEY = 'house-search:listings/{}/downtown'
+
+
+def stored_commutes():
+    redis = fakeredis.FakeRedis()
+    redis.sadd('house-search:listings', 'legacy', 'v1', 'current')
+    redis.set(DOWNTOWN_KEY.format('legacy'), str(LEGACY))
+    redis.set(DOWNTOWN_KEY.format('v1'), _pack(COMMUTE, 1, [25, 95, 12, 30, 3]))
+    redis.set(DOWNTOWN_KEY.format('current'), encode_commute(LEGACY))
+    return redis
+
+
+def test_commutes_move_to_the_current_encoding_once():
+    redis = stored_commutes()
+    assert migrate_codec.migrate(redis)['commutes'][0] == 2
+    for listing in ['legacy', 'v1', 'current']:
+        assert redis.get(DOWNTOWN_KEY.format(listing)) == encode_commute(LEGACY)
+    assert migrate_codec.migrate(redis)['commutes'][0] == 0
+
+
+def test_legacy_routes_are_kept_when_routes_are_stored(monkeypatch):
+    monkeypatch.setattr(migrate_codec, 'STORE_ROUTES', True)
+    redis = stored_commutes()
+    migrate_codec.migrate(redis)
+    assert decode_route(redis.get(route_key(DOWNTOWN_KEY.format('legacy')))) == ROUTE
+    assert decode_commute(redis.get(DOWNTOWN_KEY.format('legacy')))['transit_sections'] == 3
+    # only the legacy value still had a route to keep
+    assert redis.keys('house-search:commute_routes/*') == [route_key(DOWNTOWN_KEY.format('legacy')).encode()]
+
+
+def test_routes_are_dropped_by_default():
+    redis = stored_commutes()
+    migrate_codec.migrate(redis)
+    assert redis.keys('house-search:commute_routes/*') == []
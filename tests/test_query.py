@@ -0,0 +1,91 @@
+import itertools
+import random
+
+import numpy as np
+import pandas as pd
+
+from src.query import ListingQueryEngine
+
+NAN = float('nan')
+TYPES = ['House', 'Condo', 'Townhouse']
+
+
+def listings():
+    # NaN prices, listings without a type and listings without a downtown commute, as the snapshot has them
+    return pd.DataFrame({
+        'price': [350000, NAN, 525000, 799000, 350000, NAN, 1200000, 410000],
+        'transit_time': [25, 40, NAN, 60, NAN, 15, 90, 25],
+        'bedrooms': [3, 2, 4, NAN, 3, 1, 5, 2],
+        'bathrooms': [2, 1, 2.5, 3, NAN, 1, 4, 1.5],
+        'type': ['House', 'Condo', None, 'House', 'Townhouse', NAN, 'House', 'Condo'],
+    })
+
+
+def between(column, bounds):
+    return column.between(*bounds) if bounds is not None else pd.Series(True, index=column.index)
+
+
+def expected(df, price=None, transit_time=None, bedrooms=None, bathrooms=None, types=None):
+    mask = (between(df['price'], price) & between(df['transit_time'], transit_time)
+            & between(df['bedrooms'], bedrooms) & between(df['bathrooms'], bathrooms))
+    if types is not None:
+        named = [t for t in types if not pd.isna(t)]
+        mask &= df['type'].isin(named) | (df['type'].isna() & any(pd.isna(t) for t in types))
+    return np.flatnonzero(mask.to_numpy())
+
+
+def test_unfiltered_query_returns_every_row():
+    df = listings()
+    assert ListingQueryEngine(df).query().tolist() == list(range(len(df)))
+
+
+def test_missing_values_never_match_a_range():
+    engine = ListingQueryEngine(listings())
+    assert engine.query(price=(0, 10 ** 7)).tolist() == [0, 2, 3, 4, 6, 7]
+    assert engine.query(transit_time=(0, 180)).tolist() == [0, 1, 3, 5, 6, 7]
+    assert engine.query(bedrooms=(0, 10), bathrooms=(0, 10)).tolist() == [0, 1, 2, 5, 6, 7]
+
+
+def test_listings_without_a_type_only_match_when_asked_for():
+    engine = ListingQueryEngine(listings())
+    assert engine.query(types=['House']).tolist() == [0, 3, 6]
+    assert engine.query(types=['Condo', None]).tolist() == [1, 2, 5, 7]
+    assert engine.query(types=[]).tolist() == []
+
+
+def test_matches_a_pandas_filter():
+    df = listings()
+    engine = ListingQueryEngine(df)
+    prices = [None, (350000, 350000), (400000, 800000), (0, 10 ** 7)]
+    transit_times = [None, (25, 25), (0, 45), (30, 180)]
+    rooms = [None, (2, 3), (0, 10)]
+    baths = [None, (1, 2), (1.5, 1.5)]
+    types = [None, ['House'], ['Condo', None], TYPES]
+    for query in itertools.product(prices, transit_times, rooms, baths, types):
+        assert engine.query(*query).tolist() == expected(df, *query).tolist(), query
+
+
+def test_matches_a_pandas_filter_on_random_listings():
+    rng = random.Random(0)
+    size = 500
+
+    def maybe(value):
+        return NAN if rng.random() < 0.1 else value
+
+    df = pd.DataFrame({
+        'price': [maybe(rng.randrange(100000, 2000000, 5000)) for _ in range(size)],
+        'transit_time': [maybe(rng.randrange(0, 180)) for _ in range(size)],
+        'bedrooms': [maybe(rng.randrange(0, 7)) for _ in range(size)],
+        'bathrooms': [maybe(rng.randrange(2, 10) / 2) for _ in range(size)],
+        'type': [None if rng.random() < 0.1 else rng.choice(TYPES) for _ in range(size)],
+    })
+    engine = ListingQueryEngine(df)
+    for _ in range(200):
+        low, high = sorted(rng.randrange(100000, 2000000, 5000) for _ in range(2))
+        query = dict(price=(low, high), transit_time=tuple(sorted(rng.randrange(0, 180) for _ in range(2))),
+                     bedrooms=tuple(sorted(rng.randrange(0, 7) for _ in range(2))),
+                     bathrooms=tuple(sorted(rng.randrange(2, 10) / 2 for _ in range(2))),
+                     types=rng.sample(TYPES + [None], rng.randrange(0, 5)))
+        for name in rng.sample(list(query), rng.randrange(0, 5)):
+            query[name] = None
+        assert engine.query(**query).tolist() == expected(df, **query).tolist(), query
@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+
+from src import scoring
+from src.scoring import calculate_bike_score, calculate_bike_scores, calculate_drive_score, calculate_drive_scores, \
+    calculate_transit_score, calculate_transit_scores, calculate_walk_score, calculate_walk_scores, \
+    score_commute_batch
+
+
+def band_edges(perfect, maximum):
+    return [0, perfect - 1, perfect, perfect + 1, maximum - 1, maximum, maximum + 1, 1000]
+
+
+WALK_EDGES = band_edges(scoring.walk_perfect, scoring.walk_max)
+BIKE_EDGES = band_edges(scoring.bike_perfect, scoring.bike_max)
+DRIVE_EDGES = band_edges(scoring.drive_perfect, scoring.drive_max)
+TRANSIT_EDGES = band_edges(scoring.transit_perfect, scoring.transit_max)
+
+
+def random_rows(count, seed=0):
+    # commute times are stored as whole minutes, see codec.COMMUTE_STRUCT
+    rng = random.Random(seed)
+    rows = [(rng.randrange(120), rng.randrange(120), rng.randrange(120), rng.randrange(120), rng.randrange(1, 8))
+            for _ in range(count)]
+    # every band edge of every mode, with and without the short transit route bonus
+    for i, transit in enumerate(TRANSIT_EDGES):
+        for sections in (1, 2, 3, 4):
+            rows.append((WALK_EDGES[i], BIKE_EDGES[i], DRIVE_EDGES[i], transit, sections))
+    return rows
+
+
+def scalar_scores(rows, owners, n_owners, walk_weight, bike_weight, transit_weight, drive_weight, weighted_sum):
+    # the per listing loop score_commute_batch replaced
+    scores = []
+    for owner in range(n_owners):
+        walk_score = bike_score = transit_score = drive_score = 0
+        count = 0
+        for (walk, bike, drive, transit, sections), row_owner in zip(rows, owners):
+            if row_owner != owner:
+                continue
+            walk_score = walk_score + calculate_walk_score(walk)
+            bike_score = bike_score + calculate_bike_score(bike)
+            drive_score = drive_score + calculate_drive_score(drive)
+            transit_score = transit_score + calculate_transit_score(transit, {'sections': [None] * sections})
+            count += 1
+        scores.append((walk_score * walk_weight + bike_score * bike_weight + transit_score * transit_weight
+                       + drive_score * drive_weight) / (weighted_sum * count))
+    return scores
+
+
+def test_vectorized_scores_match_the_scalar_ones():
+    walk, bike, drive, transit, sections = zip(*random_rows(500))
+
+    assert calculate_walk_scores(walk).tolist() == [calculate_walk_score(t) for t in walk]
+    assert calculate_bike_scores(bike).tolist() == [calculate_bike_score(t) for t in bike]
+    assert calculate_drive_scores(drive).tolist() == [calculate_drive_score(t) for t in drive]
+    assert calculate_transit_scores(transit, sections).tolist() == [
+        calculate_transit_score(t, {'sections': [None] * s}) for t, s in zip(transit, sections)]
+
+
+def test_band_edges():
+    assert calculate_walk_scores(WALK_EDGES).tolist() == [10, 10, 10, 9.5, 0.5, 0, 0, 0]
+    assert calculate_transit_scores([scoring.transit_perfect + 1] * 2, [2, 3]).tolist() == [
+        10, 10 - scoring.transit_slope]
+
+
+def test_batch_matches_the_per_listing_loop():
+    rows = random_rows(300, seed=1)
+    rng = random.Random(2)
+    n_owners = 40
+    # every listing owns at least one row, the rest are spread at random
+    owners = list(range(n_owners)) + [rng.randrange(n_owners) for _ in range(len(rows) - n_owners)]
+    rng.shuffle(owners)
+
+    for weights in [(1, 1, 1, 1, 4), (3, 0, 2, 1, 6), (0.5, 1.5, 0, 2, 4)]:
+        batch = score_commute_batch(rows, owners, n_owners, *weights)
+        assert batch.tolist() == scalar_scores(rows, owners, n_owners, *weights)
+
+
+def test_batch_without_listings():
+    assert score_commute_batch([], [], 0, 1, 1, 1, 1, 4).shape == (0,)
+    assert np.array_equal(score_commute_batch([(0, 0, 0, 0, 1)], [0], 1, 1, 1, 1, 1, 4), [10])
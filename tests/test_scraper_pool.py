@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import fakeredis
+import lxml.html
+import pytest
+from selenium.common.exceptions import WebDriverException
+
+from anton.failures import FailureHandler
+from anton.scraper_pool import MAX_RECYCLES, ScraperPool, save_property
+from anton.transaction_store import TransactionStore
+from anton.work_queue import DEAD_LETTER_KEY, DELAYED_KEY, WorkQueue
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'anton', 'fixtures',
+                       'property_page.html')
+with open(FIXTURE) as f:
+    PROPERTY_PAGE = f.read()
+NOT_FOUND_PAGE = '<html><body><h1>404</h1><p>This page could not be found.</p></body></html>'
+# what a signed out session gets: the sections render but the transactions table is behind a sign in button
+SIGNED_OUT_PAGE = re.sub(r'<table.*?</table>',
+                         '<button class="ant-btn ant-btn-primary"><span>Sign in</span></button>',
+                         PROPERTY_PAGE, count=1, flags=re.S)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        slug = self.path.rsplit('/', 1)[-1]
+        if slug.startswith('missing'):
+            status, page = 404, NOT_FOUND_PAGE
+        elif slug.startswith('signed-out'):
+            status, page = 200, SIGNED_OUT_PAGE
+        else:
+            status, page = 200, PROPERTY_PAGE
+        body = page.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def fixture_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+class FakeDriver:
+    """
+    Just enough of a selenium driver for get_page_source: pages come from the local fixture server and XPaths
+    run against them with lxml. The session dies on any property in `kills`.
+    """
+
+    def __init__(self, server, kills):
+        self.server = server
+        self.kills = kills
+        self.dead = False
+        self.page_source = ''
+
+    @property
+    def current_url(self):
+        if self.dead:
+            raise WebDriverException('chrome not reachable')
+        return self.server
+
+    def get(self, url):
+        path = urlparse(url).path
+        if self.dead or self.kills(path):
+            self.dead = True
+            raise WebDriverException('chrome not reachable')
+        try:
+            with urllib.request.urlopen(self.server + path) as r:
+                self.page_source = r.read().decode()
+        except urllib.error.HTTPError as e:
+            self.page_source = e.read().decode()
+
+    def find_elements_by_xpath(self, xpath):
+        return lxml.html.fromstring(self.page_source).xpath(xpath)
+
+    def quit(self):
+        self.dead = True
+
+
+class FakeBrowser:
+    """login() for the pool, counts sessions and decides which pages kill them."""
+
+    def __init__(self, server, kills=lambda path: False):
+        self.server = server
+        self.kills = kills
+        self.logins = 0
+        self._lock = threading.Lock()
+
+    def login(self, headless=True):
+        with self._lock:
+            self.logins += 1
+        return FakeDriver(self.server, self.kills)
+
+
+def properties(n, prefix='house'):
+    return [f'{prefix}-{i}-some-street-sw-calgary-ab-t2t' for i in range(n)]
+
+
+def test_pool_drains_the_queue(fixture_server, tmp_path):
+    redis = fakeredis.FakeRedis()
+    browser = FakeBrowser(fixture_server)
+    handled = []
+    lock = threading.Lock()
+
+    with TransactionStore(tmp_path) as store:
+        def handle(property, page_str):
+            save_property(redis, property, page_str, store)
+            with lock:
+                handled.append(property)
+
+        done = ScraperPool(workers=4, login=browser.login).run(properties(20) + properties(2, 'missing'), handle)
+    assert sorted(handled) == sorted(properties(20) + properties(2, 'missing'))
+    assert done['ok'] == 22 and done['failed'] == 0
+    assert browser.logins <= 4
+    assert redis.scard('house-search:listings_honestdoor') == 20
+    assert redis.scard('house-search:listings_honestdoor_blacklist') == 2
+    assert len(store.index()) == 20
+
+
+def test_dead_sessions_are_recycled_up_to_max_recycles(fixture_server):
+    deadly = properties(1, 'deadly')[0]
+    flaky = properties(1, 'flaky')[0]
+    flaky_deaths = []
+
+    def kills(path):
+        if 'deadly' in path:
+            return True
+        if 'flaky' in path and not flaky_deaths:
+            flaky_deaths.append(path)
+            return True
+        return False
+
+    browser = FakeBrowser(fixture_server, kills)
+    failures = []
+    handled = []
+    pool = ScraperPool(workers=2, login=browser.login, on_failure=lambda p, e: failures.append((p, e)))
+    done = pool.run(properties(6) + [deadly, flaky], lambda p, page_str: handled.append(p))
+
+    assert sorted(handled) == sorted(properties(6) + [flaky])
+    assert pool.recycled[deadly] == MAX_RECYCLES + 1
+    assert pool.recycled[flaky] == 1
+    assert [(p, type(e)) for p, e in failures] == [(deadly, WebDriverException)]
+    assert done['ok'] == 7 and done['failed'] == 1
+    # the first sessions plus a fresh one after each death
+    assert browser.logins <= 2 + (MAX_RECYCLES + 1) + 1
+
+
+def test_failures_are_routed_to_the_work_queue(fixture_server, tmp_path):
+    redis = fakeredis.FakeRedis()
+    work_queue = WorkQueue(redis)
+    browser = FakeBrowser(fixture_server)
+    signed_out = properties(1, 'signed-out')[0]
+    broken = properties(1, 'broken')[0]
+    routed = []
+    failure_handler = FailureHandler(work_queue)
+
+    def on_failure(property, error):
+        routed.append((property, failure_handler(property, error)))
+
+    with TransactionStore(tmp_path) as store:
+        def handle(property, page_str):
+            if property == broken:
+                raise KeyError('assessment_price')
+            save_property(redis, property, page_str, store)
+
+        pool = ScraperPool(workers=1, login=browser.login, on_failure=on_failure)
+        done = pool.run([signed_out, broken] + properties(3), handle)
+
+    assert sorted(routed) == sorted([(signed_out, 'auth'), (broken, 'permanent')])
+    assert done['ok'] == 3 and done['failed'] == 2
+    # the signed out session was dropped and the next property got a fresh login
+    assert browser.logins == 2
+    assert redis.zscore(DELAYED_KEY, signed_out) is not None
+    assert redis.sismember(DEAD_LETTER_KEY, broken)
+
+
+def test_sessions_are_kept_across_runs(fixture_server):
+    browser = FakeBrowser(fixture_server)
+    handled = []
+    with ScraperPool(workers=2, login=browser.login) as pool:
+        for batch in range(3):
+            assert pool.run(properties(4, f'batch{batch}'), lambda p, page_str: handled.append(p))['ok'] == 4
+        assert browser.logins <= 2
+        # a session that died while idle is replaced rather than handed out
+        driver = pool.acquire()
+        driver.quit()
+        pool.release(driver)
+        pool.run(properties(4, 'after'), lambda p, page_str: handled.append(p))
+    assert len(handled) == 16
+    assert pool.recycled == {}
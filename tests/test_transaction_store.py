@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import fakeredis
+import pandas as pd
+
+from anton.transaction_store import INDEX_SUFFIX, OPEN_SUFFIX, SEALED_SUFFIX, TransactionStore
+from src.codec import decode_transactions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a scraper that appends and dies without close(), leaving its segment open
+DEAD_WRITER = """
+import os, sys
+import pandas as pd
+from anton.transaction_store import TransactionStore
+store = TransactionStore(sys.argv[1], flush_every=2)
+for i in range(5):
+    store.append(f'p{i}', pd.DataFrame({'price': [100.0 + i], 'property_id': [f'p{i}']}))
+store.flush()
+os._exit(1)
+"""
+
+
+def transactions(property):
+    return pd.DataFrame({'date': ['2020-01-01', None], 'price': [100.0, float('nan')],
+                         'property_id': [property, property]})
+
+
+def kill_writer(directory):
+    subprocess.run([sys.executable, '-c', DEAD_WRITER, str(directory)], cwd=ROOT, check=False)
+
+
+def test_append_get_compact_replay(tmp_path):
+    with TransactionStore(tmp_path, flush_every=3, segment_bytes=300) as store:
+        for i in range(10):
+            store.append(f'p{i % 6}', transactions(f'p{i % 6}'))
+    assert len(store.segments()) > 1
+    assert store.get('p1')['property_id'].tolist() == ['p1', 'p1']
+    assert store.get('missing') is None
+
+    assert store.compact() == 6
+    assert len(store.segments()) == 1
+    redis = fakeredis.FakeRedis()
+    assert store.replay(redis) == 6
+    assert redis.scard('house-search:listings_honestdoor') == 6
+    df = decode_transactions(redis.get('house-search:listings_honestdoor/p3'))
+    assert df['price'].tolist()[0] == 100.0
+
+
+def test_open_segment_of_a_dead_writer_is_recovered(tmp_path):
+    kill_writer(tmp_path)
+    assert len(list(tmp_path.glob('*' + OPEN_SUFFIX))) == 1
+
+    store = TransactionStore(tmp_path)
+    assert list(tmp_path.glob('*' + OPEN_SUFFIX)) == []
+    assert store.get('p0')['price'].tolist() == [100.0]
+    assert store.replay(fakeredis.FakeRedis()) == 5
+
+
+def test_recovery_drops_a_torn_tail(tmp_path):
+    kill_writer(tmp_path)
+    (segment,) = tmp_path.glob('*' + OPEN_SUFFIX)
+    index = str(segment)[:-len(OPEN_SUFFIX)] + INDEX_SUFFIX
+    # the crash hit halfway through a flush: half a record and half an index line
+    with open(segment, 'ab') as f:
+        f.write(b'{"property": "p5", "scraped_at": 1, "col')
+    with open(index, 'a') as f:
+        f.write(f'p5\t{os.path.getsize(segment) - 10}')
+
+    store = TransactionStore(tmp_path)
+    assert sorted(store.index()) == ['p0', 'p1', 'p2', 'p3', 'p4']
+    (sealed,) = tmp_path.glob('*' + SEALED_SUFFIX)
+    assert sealed.read_bytes().endswith(b'\n')
+    assert len(list(store.records())) == 5
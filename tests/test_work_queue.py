@@ -0,0 +1,92 @@
+import fakeredis
+from selenium.common.exceptions import WebDriverException
+
+from anton.failures import FailureHandler
+from anton.work_queue import BLACKLIST_KEY, DEAD_LETTER_KEY, DELAYED_KEY, LISTINGS_KEY, SCRAPED_KEY, WorkQueue
+
+
+def test_backing_off_property_is_not_requeued():
+    redis = fakeredis.FakeRedis()
+    redis.sadd(LISTINGS_KEY, 'a', 'b')
+    work_queue = WorkQueue(redis)
+    work_queue.enqueue_new()
+    assert sorted(work_queue.claim(5)) == ['a', 'b']
+
+    FailureHandler(work_queue)('a', WebDriverException('timeout'))
+    # another scheduler starting up, and a stale pass that would also pick it
+    redis.zadd(SCRAPED_KEY, {'a': 0})
+    work_queue.enqueue_new()
+    work_queue.enqueue_stale()
+    assert 'a' not in work_queue.claim(5)
+    assert redis.zscore(DELAYED_KEY, 'a') is not None
+
+
+def test_complete_clears_the_delay():
+    redis = fakeredis.FakeRedis()
+    work_queue = WorkQueue(redis)
+    work_queue.retry('a', 0)
+    work_queue.complete('a')
+    assert work_queue.claim(5) == []
+    assert work_queue.sizes()['delayed'] == 0
+
+
+def test_dead_lettered_and_blacklisted_properties_are_not_refreshed():
+    redis = fakeredis.FakeRedis()
+    work_queue = WorkQueue(redis)
+    redis.zadd(SCRAPED_KEY, {'a': 0, 'b': 0, 'c': 0})
+    work_queue.dead_letter('a', 'permanent', 'ValueError: no table', attempts=1)
+    redis.sadd(BLACKLIST_KEY, 'b')
+    work_queue.complete('b', scraped=False)
+    assert redis.zscore(SCRAPED_KEY, 'a') is None and redis.zscore(SCRAPED_KEY, 'b') is None
+    assert work_queue.enqueue_stale() == 1
+    assert work_queue.claim(5) == ['c']
+
+
+def test_stale_pass_skips_dead_letters_still_marked_scraped():
+    # data from before dead_letter dropped the scraped time
+    redis = fakeredis.FakeRedis()
+    work_queue = WorkQueue(redis)
+    redis.zadd(SCRAPED_KEY, {'a': 0, 'b': 0})
+    redis.sadd(DEAD_LETTER_KEY, 'a')
+    redis.sadd(BLACKLIST_KEY, 'b')
+    assert work_queue.enqueue_stale() == 0
+    assert work_queue.claim(5) == []
+
+
+def test_new_listings_are_claimed_before_stale_ones():
+    redis = fakeredis.FakeRedis()
+    work_queue = WorkQueue(redis)
+    redis.zadd(SCRAPED_KEY, {'old-1': 0, 'old-2': 0})
+    work_queue.enqueue_stale()
+    # queued after the stale pass, still ahead of it
+    redis.sadd(LISTINGS_KEY, 'new-1', 'new-2')
+    work_queue.enqueue_new()
+    assert sorted(work_queue.claim(2)) == ['new-1', 'new-2']
+    assert sorted(work_queue.claim(2)) == ['old-1', 'old-2']
+
+
+def test_expired_lease_is_handed_out_again():
+    redis = fakeredis.FakeRedis()
+    redis.sadd(LISTINGS_KEY, 'a')
+    # a scraper whose lease ran out the moment it claimed, as if it crashed
+    crashed = WorkQueue(redis, visibility_timeout=-1)
+    crashed.enqueue_new()
+    assert crashed.claim() == ['a']
+    work_queue = WorkQueue(redis)
+    assert work_queue.claim() == ['a']
+    # now leased for the full timeout, nobody else gets it
+    assert work_queue.claim() == []
+    assert work_queue.sizes()['leased'] == 1
+
+
+def test_complete_releases_the_lease():
+    redis = fakeredis.FakeRedis()
+    redis.sadd(LISTINGS_KEY, 'a')
+    work_queue = WorkQueue(redis, visibility_timeout=-1)
+    work_queue.enqueue_new()
+    assert work_queue.claim() == ['a']
+    work_queue.complete('a')
+    assert work_queue.sizes()['leased'] == 0
+    # even with the lease long expired, a finished property is not handed out again
+    assert work_queue.claim() == []
+    assert redis.zscore(SCRAPED_KEY, 'a') is not None